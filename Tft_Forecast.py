@@ -1,24 +1,24 @@
 import base64
-from scipy import io
 import io
-import torch
-import pandas as pd
+import re
 import numpy as np
 import os
 import json
-from datetime import datetime, timedelta
-from darts import TimeSeries
-from darts.models import TFTModel
-from darts.dataprocessing.transformers import Scaler
+import time
 from flask import Flask, request, jsonify
-from collections import deque
-import matplotlib.pyplot as plt
-import seaborn as sns
 import threading
-import matplotlib
-# Add import for Kalman filter
-from filterpy.kalman import KalmanFilter
-matplotlib.use('Agg')  # Use non-interactive backend for saving plots
+import metrics
+# The forecasting stack (pandas, darts) is imported here, and darts imports
+# matplotlib.pyplot with it; torch and the TFT model are only imported when
+# the model is loaded
+from forecasting import BAND, ForecastService, load_dataset_snapshot, make_scaler, predict_batch
+import risk_engine
+from risk_engine import RISK_LABELS, subjects
+from ingestion_server import (
+    REQUEST_STAGE_SECONDS, frame_listener, history_store, ingestion, lookup_subject, pipeline, unknown_subject
+)
+from ring_buffer import timestamps_iso
+from subjects import DEFAULT_SUBJECT
 
 # Create a directory for offline graphs if it doesn't exist
 os.makedirs("static/graphs", exist_ok=True)
@@ -26,179 +26,136 @@ os.makedirs("static/graphs", exist_ok=True)
 # ✅ Initialize Flask App
 app = Flask(__name__)
 
-# ✅ Load dataset
-df = pd.read_csv("processed_data.csv", parse_dates=["Time of Reading"])
-df.drop(columns=["UV Index"], errors="ignore", inplace=True)
-df = df.groupby("Time of Reading").mean().reset_index()
-df = df.sort_values("Time of Reading").set_index("Time of Reading").asfreq("h").interpolate()
-df.fillna(method="ffill", inplace=True)
-df.fillna(method="bfill", inplace=True)
+# ✅ Load dataset (the cleaned hourly frame is cached as an NPZ snapshot)
+df, scaler_bounds = load_dataset_snapshot("processed_data.csv")
 
 # ✅ Normalize & Prepare Data
-scaler = Scaler()
-series = TimeSeries.from_dataframe(df, value_cols=df.columns)
-series = scaler.fit_transform(series)
-train, val = series.split_before(0.8)
+scaler = make_scaler(df.columns, scaler_bounds)
 
 # ✅ Load or Train TFT Model
-device = "cuda" if torch.cuda.is_available() else "cpu"
+# The model is loaded in the background so ingestion is live immediately.
+# Until the startup forecast exists, risk scores skip the forecast deviation term.
 model_path = "tft_model.pth"
+lean_model_path = "tft_model.ts.pt"  # Preferred when exported by tft_inference.py
+model = None
+preds_df = None
+startup_forecast = None
 
-if os.path.exists(model_path):
-    choice = input("🤔 A pre-trained model is detected. Use it? yes or no -> ")
-    if choice.lower() == "yes":
-        model = TFTModel.load(model_path)
-else:
-    model = TFTModel(
-        input_chunk_length=24, output_chunk_length=12, hidden_size=64,
-        lstm_layers=1, num_attention_heads=4, dropout=0.1, batch_size=32,
-        n_epochs=50, add_relative_index=True, optimizer_kwargs={"lr": 1e-3}
-    )
-    model.fit(train, val_series=val, verbose=True)
-    model.save(model_path)
-
-# ✅ Get TFT Predictions
-future_dates = [datetime.today() + timedelta(hours=i) for i in range(24)]
-preds = model.predict(n=24)
-preds_df = scaler.inverse_transform(preds).pd_dataframe().reset_index()
-
-# ✅ Real-time Data Storage
-trend_window = deque(maxlen=30)  # Store last 30 seconds of data
-risk_history = deque(maxlen=100)  # Store last 100 risk assessments
-vitals_history = deque(maxlen=100)  # Store history of vitals
-
-# Store both raw and filtered values for potential visualization
-raw_values = [[] for _ in range(5)]
-filtered_values = [[] for _ in range(5)]
-
-# ✅ Initialize vitals as empty (default to 0 if not received)
-current_vitals = {}
-filtered_vitals = {}
-
-last_risk_assessment = {
-    "Risk (%)": 0,
-    "Status": "Waiting for data...",
-    "timestamp": datetime.now().isoformat(),
-    "vitals": {}
-}
+def load_model():
+    """Load the TFT model (training one if none is saved) and make the startup forecast"""
+    global model, preds_df, startup_forecast
+    if os.path.exists(lean_model_path):
+        # TorchScript network: torch only, no Lightning trainer per predict call
+        from tft_inference import LeanForecaster
+        loaded = LeanForecaster.load(lean_model_path)
+    else:
+        from darts.models import TFTModel
+        if os.path.exists(model_path):
+            loaded = TFTModel.load(model_path)
+        else:
+            # Default config with early stopping; tft_training.py sweeps alternatives
+            from darts import TimeSeries
+            from tft_training import train_model
+            series = scaler.transform(TimeSeries.from_dataframe(df, value_cols=df.columns))
+            train, val = series.split_before(0.8)
+            loaded, _ = train_model({}, train, val, verbose=True)
+            loaded.save(model_path)
+    
+    # ✅ Get TFT Predictions
+    # Quantiles per step, with the bands and stats the risk engine and the
+    # distribution graph read computed once here
+    startup_forecast = predict_batch(loaded, {DEFAULT_SUBJECT: df}, scaler, horizon=24)[DEFAULT_SUBJECT]
+    preds_df = startup_forecast.preds_df
+    model = loaded
+    forecaster.model = loaded
+    data_versions["preds"] += 1
+
+def load_model_in_background():
+    thread = threading.Thread(target=load_model, name="model-loader", daemon=True)
+    thread.start()
+    return thread
 
-# ✅ Initialize Kalman Filters for each vital parameter
-# Global Kalman filter objects
-kf = [
-    KalmanFilter(dim_x=2, dim_z=1),  # V0 - Atmospheric Temp
-    KalmanFilter(dim_x=2, dim_z=1),  # V1 - Humidity
-    KalmanFilter(dim_x=2, dim_z=1),  # V2 - Body Temp
-    KalmanFilter(dim_x=2, dim_z=1),  # V3 - SpO2
-    KalmanFilter(dim_x=2, dim_z=1)   # V4 - Heart Rate
-]
-
-# Set up the Kalman filters with specialized settings for each parameter
-def setup_kalman_filters():
-    # Custom Kalman filter settings for each parameter
-    kf_settings = [
-        {"Q": [[1e-5, 0], [0, 1e-5]], "R": 1e-2},  # V0 - Atmospheric Temp (slow variations)
-        {"Q": [[5e-5, 0], [0, 5e-5]], "R": 2.5e-2},  # V1 - Humidity (medium variability)
-        {"Q": [[1e-5, 0], [0, 1e-5]], "R": 0.3},  # V2 - Body Temp (smooth, precise, ±2°C flexibility)
-        {"Q": [[5e-5, 0], [0, 5e-5]], "R": 0.2},  # V3 - SpO2 (±3 tolerance, reacts <95%)
-        {"Q": [[1e-6, 0], [0, 1e-6]], "R": 1.0}   # V4 - Heart Rate (rigid, prevents erratic jumps)
+# ✅ Graph Cache
+# Each data source carries a version counter that is bumped whenever it changes.
+# A graph is re-rendered only when the versions of the sources it reads differ
+# from the ones it was rendered with. Graphs built from a subject's histories
+# are versioned and cached on its SubjectState instead.
+data_versions = {"preds": 0}
+graph_cache = {}  # (graph name, include_image) -> (data version, rendered graph)
+pyplot_lock = threading.Lock()  # pyplot is not thread-safe: taken only to render images
+GRAPH_RENDER_SECONDS = metrics.Histogram(
+    "heatstroke_graph_render_seconds", "Time to build a graph on a cache miss", ("graph", "mode")
+)
+GRAPH_CACHE = metrics.Counter("heatstroke_graph_cache_total", "Graph cache lookups", ("graph", "result"))
+
+# ✅ Rolling Re-forecasts (refreshed per subject in the background)
+forecaster = ForecastService(None, scaler, df, subjects, interval=60, horizon=24,
+                             history=history_store)  # Model set by load_model
+
+def collect_forecast_metrics():
+    cache = forecaster.cache
+    return [
+        ("heatstroke_model_loaded", "gauge", "1 once the TFT model is loaded", [({}, int(model is not None))]),
+        ("heatstroke_forecasts", "gauge", "Subjects with a rolling re-forecast", [({}, len(forecaster.forecasts))]),
+        ("heatstroke_forecast_cache_total", "counter", "Forecast cache lookups",
+         [({"result": "hit"}, cache.hits), ({"result": "miss"}, cache.misses)]),
+        ("heatstroke_forecast_cache_entries", "gauge", "Forecasts held in the cache", [({}, len(cache))]),
     ]
 
-    # Apply settings to each Kalman filter
-    for i in range(5):
-        kf[i].x = np.array([[0.], [0.]])  # Initial state (position, velocity)
-        kf[i].F = np.array([[1., 1.], [0., 1.]])  # State transition matrix
-        kf[i].H = np.array([[1., 0.]])  # Measurement function
-        kf[i].P *= 1e6  # Large initial uncertainty
-        kf[i].R = kf_settings[i]["R"]  # Measurement noise
-        kf[i].Q = np.array(kf_settings[i]["Q"])  # Process noise
-
-# Function to filter incoming vital readings through Kalman filters
-def filter_vitals(raw_vitals):
-    filtered = {}
-    
-    # Process each vital through its corresponding Kalman filter
-    for i in range(5):
-        vital_key = f"V{i}"
-        value = raw_vitals.get(vital_key, 0)
-        
-        # Store raw value
-        raw_values[i].append(value)
-        if len(raw_values[i]) > 100:  # Keep history limited
-            raw_values[i].pop(0)
-        
-        # Apply Kalman filter
-        kf[i].predict()
-        kf[i].update(value)
-        filtered_value = round(float(kf[i].x[0, 0]), 3)  # Get position estimate
-        
-        # Store filtered value
-        filtered_values[i].append(filtered_value)
-        if len(filtered_values[i]) > 100:  # Keep history limited
-            filtered_values[i].pop(0)
-        
-        # Add to filtered vitals dictionary
-        filtered[vital_key] = filtered_value
-    
-    return filtered
-
-# ✅ Risk Calculation Based on Trends & Model
-def calculate_heatstroke_risk(vitals):
-    body_temp = vitals.get("V2", 0)  # Body Temperature (°C)
-    heart_rate = vitals.get("V4", 0)  # Heart Rate (bpm)
-    humidity = vitals.get("V1", 0)  # Relative Humidity (%)
-    spo2 = vitals.get("V3", 0)  # SpO2 (Oxygen Saturation)
-    atm_temp = vitals.get("V0", 0)  # Atmospheric Temperature (°C)
-    
-    # Estimate Solar Radiation (W/m²) from Atmospheric Temperature
-    solar_radiation = max(0, (atm_temp - 15) * 50)  # Rough estimation
-    
-    # Compute risk score based on vitals
-    risk_score = (
-        (body_temp / 42) * 40 + (heart_rate / 200) * 25 + 
-        (humidity / 100) * 20 + (solar_radiation / 1000) * 10 - (spo2 / 100) * 15
-    )
-    live_risk = min(max(risk_score, 0), 100)
-    
-    # Compare against TFT predictions
-    tft_pred_temp = preds_df["Body Temperature (°C)"].mean()
-    deviation = abs(body_temp - tft_pred_temp) / tft_pred_temp * 100 if tft_pred_temp != 0 else 0
-    model_adjusted_risk = min(live_risk + deviation, 100)
-    
-    # Analyze trends
-    trend_window.append(model_adjusted_risk)
-    moving_avg = np.mean(trend_window) if trend_window else 0
-    spikes = sum(1 for r in trend_window if r > moving_avg + 10)  # Count major spikes
-    
-    # Adjust final risk based on trends
-    if moving_avg > 80:
-        risk_label = "UNSTABLE 🚨"
-    elif spikes > 5 or moving_avg > 60:
-        risk_label = "Monitor Closely ⚠️"
-    else:
-        risk_label = "Stable ✅"
-    
-    # Store this assessment with timestamp and vitals
-    assessment = {
-        "Risk (%)": round(model_adjusted_risk, 2),
-        "Status": risk_label,
-        "timestamp": datetime.now().isoformat(),
-        "vitals": vitals.copy()
-    }
-    
-    # Update global variables
-    global last_risk_assessment
-    last_risk_assessment = assessment
-    risk_history.append(assessment)
+metrics.register_collector(collect_forecast_metrics)
+
+# ✅ Forecasts for the Risk Engine
+def subject_forecast(state):
+    """A subject's latest re-forecast, or the startup forecast until it has one"""
+    return forecaster.get(state.subject_id) or startup_forecast
+
+def forecast_band(state):
+    """A subject's (point, lower, upper) forecast body temperature for now (precomputed per forecast)"""
+    forecast = subject_forecast(state)
+    # None (no forecast yet) disables the deviation term
+    return forecast.band_at("Body Temperature (°C)") if forecast is not None else None
+
+risk_engine.forecast_source = forecast_band
+
+# ✅ Visualization Functions
+# Seaborn is only needed when a client explicitly asks for images, so it is
+# imported on first use. matplotlib is already loaded at startup through darts;
+# only the slim ingestion_server.py runs without the plotting stack
+plt = None
+sns = None
+
+def load_plotting():
+    """Bind pyplot and import seaborn on first use"""
+    global plt, sns
+    if plt is None:
+        import matplotlib
+        matplotlib.use('Agg')  # Use non-interactive backend for saving plots
+        import matplotlib.pyplot as pyplot
+        import seaborn
+        plt, sns = pyplot, seaborn
+
+def save_figure(fig, filename):
+    """Save an offline copy of a figure and return it as a base64 PNG"""
+    # Save offline copy
+    plt.tight_layout()
+    fig.savefig(f'static/graphs/{filename}')
     
-    # Store vitals history for visualization
-    vitals_with_timestamp = vitals.copy()
-    vitals_with_timestamp["timestamp"] = datetime.now().isoformat()
-    vitals_history.append(vitals_with_timestamp)
+    # Convert to base64 for API response
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png')
+    buf.seek(0)
+    img_base64 = base64.b64encode(buf.read()).decode('utf-8')
+    plt.close(fig)
     
-    return assessment
+    return img_base64
 
-# ✅ Visualization Functions
-def generate_feature_importance():
+def subject_filename(state, filename):
+    """Offline file name for a subject's graph (unprefixed for the default subject)"""
+    if state.subject_id == DEFAULT_SUBJECT:
+        return filename
+    return re.sub(r'[^A-Za-z0-9_-]', '_', state.subject_id) + '_' + filename
+
+def generate_feature_importance(include_image=True):
     """Generate feature importance visualization"""
     # In a real implementation, get this from the model
     # Here using placeholder data similar to what TFT would provide
@@ -210,7 +167,12 @@ def generate_feature_importance():
         "Atmospheric Temperature (°C)": 0.40
     }
     
+    graph = {'data': feature_importance}
+    if not include_image:
+        return graph
+    
     # Create visualization
+    load_plotting()
     fig, ax = plt.subplots(figsize=(10, 6))
     features = list(feature_importance.keys())
     importance = list(feature_importance.values())
@@ -221,73 +183,70 @@ def generate_feature_importance():
     ax.set_title('Feature Importance for Heatstroke Risk Prediction')
     ax.set_xlabel('Importance Score')
     
-    # Save offline copy
-    plt.tight_layout()
-    fig.savefig('static/graphs/feature_importance.png')
-    
-    # Convert to base64 for API response
-    buf = io.BytesIO()
-    fig.savefig(buf, format='png')
-    buf.seek(0)
-    img_base64 = base64.b64encode(buf.read()).decode('utf-8')
-    plt.close(fig)
-    
-    return {
-        'image': img_base64,
-        'data': feature_importance
-    }
+    graph['image'] = save_figure(fig, 'feature_importance.png')
+    return graph
 
-def generate_forecast_distribution():
+def generate_forecast_distribution(include_image=True):
     """Generate forecast distribution visualization"""
-    # Extract forecast data
-    forecast_values = preds_df["Body Temperature (°C)"].values
-    
+    if startup_forecast is None:
+        graph = {'data': {'error': 'Forecast not ready yet'}}
+        if include_image:
+            graph['image'] = ''
+        return graph
+    
+    # Statistics and interval band precomputed with the forecast
+    column = "Body Temperature (°C)"
+    graph = {'data': startup_forecast.stats[column]}
+    if not include_image:
+        return graph
+    
+    load_plotting()
+    point, lower, upper = np.array(startup_forecast.bands[column]).T
+    steps = np.arange(1, len(point) + 1)
     fig, ax = plt.subplots(figsize=(10, 6))
-    sns.histplot(forecast_values, kde=True, ax=ax)
+    ax.fill_between(steps, lower, upper, alpha=0.3, label=f'{BAND[0]:.0%}-{BAND[1]:.0%} interval')
+    ax.plot(steps, point, marker='o', label='Median forecast')
     ax.set_title('Distribution of Forecasted Body Temperature')
-    ax.set_xlabel('Body Temperature (°C)')
-    ax.set_ylabel('Frequency')
+    ax.set_xlabel('Hours Ahead')
+    ax.set_ylabel('Body Temperature (°C)')
+    ax.legend()
     
-    # Save offline copy
-    plt.tight_layout()
-    fig.savefig('static/graphs/forecast_distribution.png')
+    graph['image'] = save_figure(fig, 'forecast_distribution.png')
+    return graph
+
+def not_enough_data(include_image):
+    """Placeholder returned by history graphs until two points exist"""
+    graph = {'data': {'error': 'Not enough data points yet'}}
+    if include_image:
+        graph['image'] = ''
+    return graph
+
+def generate_trend_rolling_mean(state, include_image=True):
+    """Generate trend visualization using rolling mean"""
+    if len(state.history) < 2:
+        return not_enough_data(include_image)
     
-    # Convert to base64 for API response
-    buf = io.BytesIO()
-    fig.savefig(buf, format='png')
-    buf.seek(0)
-    img_base64 = base64.b64encode(buf.read()).decode('utf-8')
-    plt.close(fig)
+    # Extract data (one copy of the history, so appends cannot shift the columns)
+    timestamps, columns = state.history.snapshot()
+    risk_values = columns["risk"]
     
-    # Calculate statistics for the distribution
-    stats = {
-        'mean': float(np.mean(forecast_values)),
-        'median': float(np.median(forecast_values)),
-        'std': float(np.std(forecast_values)),
-        'min': float(np.min(forecast_values)),
-        'max': float(np.max(forecast_values)),
-    }
+    # Rolling mean, maintained incrementally as each assessment is recorded
+    rolling_window = state.rolling.size
+    rolling_mean = columns["rolling_mean"]
     
-    return {
-        'image': img_base64,
-        'data': stats
+    trend_data = {
+        'timestamps': timestamps_iso(timestamps),
+        'risk_values': risk_values.tolist(),
+        'rolling_mean': rolling_mean.tolist()
     }
-
-def generate_trend_rolling_mean():
-    """Generate trend visualization using rolling mean"""
-    if len(risk_history) < 2:
-        return {'image': '', 'data': {'error': 'Not enough data points yet'}}
-    
-    # Extract data
-    timestamps = [datetime.fromisoformat(item["timestamp"]) for item in risk_history]
-    risk_values = [item["Risk (%)"] for item in risk_history]
     
-    # Calculate rolling mean
-    risk_series = pd.Series(risk_values)
-    rolling_window = min(5, len(risk_values))  # Adjust window size based on available data
-    rolling_mean = risk_series.rolling(window=rolling_window).mean()
+    graph = {'data': trend_data}
+    if not include_image:
+        return graph
     
     # Create visualization
+    load_plotting()
+    timestamps = timestamps.astype('datetime64[us]')
     fig, ax = plt.subplots(figsize=(10, 6))
     ax.plot(timestamps, risk_values, 'o-', label='Risk Values', alpha=0.7)
     ax.plot(timestamps, rolling_mean, 'r-', label=f'Rolling Mean (window={rolling_window})', linewidth=2)
@@ -301,43 +260,35 @@ def generate_trend_rolling_mean():
     # Format x-axis to show time properly
     fig.autofmt_xdate()
     
-    # Save offline copy
-    plt.tight_layout()
-    fig.savefig('static/graphs/risk_trend.png')
+    graph['image'] = save_figure(fig, subject_filename(state, 'risk_trend.png'))
+    return graph
+
+def generate_volatility(state, include_image=True):
+    """Generate volatility visualization using moving standard deviation"""
+    if len(state.history) < 2:
+        return not_enough_data(include_image)
     
-    # Convert to base64 for API response
-    buf = io.BytesIO()
-    fig.savefig(buf, format='png')
-    buf.seek(0)
-    img_base64 = base64.b64encode(buf.read()).decode('utf-8')
-    plt.close(fig)
+    # Extract data (one copy of the history, so appends cannot shift the columns)
+    timestamps, columns = state.history.snapshot()
+    risk_values = columns["risk"]
     
-    trend_data = {
-        'timestamps': [ts.isoformat() for ts in timestamps],
-        'risk_values': risk_values,
-        'rolling_mean': rolling_mean.fillna(0).tolist()
-    }
+    # Moving standard deviation (volatility), maintained incrementally
+    rolling_window = state.rolling.size
+    volatility = columns["volatility"]
     
-    return {
-        'image': img_base64,
-        'data': trend_data
+    volatility_data = {
+        'timestamps': timestamps_iso(timestamps),
+        'risk_values': risk_values.tolist(),
+        'volatility': volatility.tolist()
     }
-
-def generate_volatility():
-    """Generate volatility visualization using moving standard deviation"""
-    if len(risk_history) < 2:
-        return {'image': '', 'data': {'error': 'Not enough data points yet'}}
-    
-    # Extract data
-    timestamps = [datetime.fromisoformat(item["timestamp"]) for item in risk_history]
-    risk_values = [item["Risk (%)"] for item in risk_history]
     
-    # Calculate moving standard deviation (volatility)
-    risk_series = pd.Series(risk_values)
-    rolling_window = min(5, len(risk_values))  # Adjust window size based on available data
-    volatility = risk_series.rolling(window=rolling_window).std()
+    graph = {'data': volatility_data}
+    if not include_image:
+        return graph
     
     # Create visualization
+    load_plotting()
+    timestamps = timestamps.astype('datetime64[us]')
     fig, ax = plt.subplots(figsize=(10, 6))
     ax.plot(timestamps, risk_values, 'o-', label='Risk Values', alpha=0.5)
     ax.plot(timestamps, volatility, 'g-', label=f'Volatility (Moving STD, window={rolling_window})', linewidth=2)
@@ -351,40 +302,34 @@ def generate_volatility():
     # Format x-axis to show time properly
     fig.autofmt_xdate()
     
-    # Save offline copy
-    plt.tight_layout()
-    fig.savefig('static/graphs/risk_volatility.png')
-    
-    # Convert to base64 for API response
-    buf = io.BytesIO()
-    fig.savefig(buf, format='png')
-    buf.seek(0)
-    img_base64 = base64.b64encode(buf.read()).decode('utf-8')
-    plt.close(fig)
+    graph['image'] = save_figure(fig, subject_filename(state, 'risk_volatility.png'))
+    return graph
+
+def generate_vitals_plot(state, include_image=True):
+    """Generate plot of input vitals over time"""
+    if len(state.history) < 2:
+        return not_enough_data(include_image)
     
-    volatility_data = {
-        'timestamps': [ts.isoformat() for ts in timestamps],
-        'risk_values': risk_values,
-        'volatility': volatility.fillna(0).tolist()
-    }
+    # Extract data (one copy of the history, so appends cannot shift the columns)
+    timestamps, columns = state.history.snapshot()
+    body_temp = columns["V2"]
+    heart_rate = columns["V4"]
+    spo2 = columns["V3"]
     
-    return {
-        'image': img_base64,
-        'data': volatility_data
+    vitals_data = {
+        'timestamps': timestamps_iso(timestamps),
+        'body_temperature': body_temp.tolist(),
+        'heart_rate': heart_rate.tolist(),
+        'spo2': spo2.tolist()
     }
-
-def generate_vitals_plot():
-    """Generate plot of input vitals over time"""
-    if len(vitals_history) < 2:
-        return {'image': '', 'data': {'error': 'Not enough data points yet'}}
     
-    # Extract data
-    timestamps = [datetime.fromisoformat(item["timestamp"]) for item in vitals_history]
-    body_temp = [item["V2"] for item in vitals_history]
-    heart_rate = [item["V4"] for item in vitals_history]
-    spo2 = [item["V3"] for item in vitals_history]
+    graph = {'data': vitals_data}
+    if not include_image:
+        return graph
     
     # Create visualization
+    load_plotting()
+    timestamps = timestamps.astype('datetime64[us]')
     fig, ax = plt.subplots(figsize=(12, 8))
     
     ax.plot(timestamps, body_temp, 'r-', label='Body Temperature (°C)', linewidth=2)
@@ -416,38 +361,28 @@ def generate_vitals_plot():
     # Format x-axis to show time properly
     fig.autofmt_xdate()
     
-    # Save offline copy
-    plt.tight_layout()
-    fig.savefig('static/graphs/vitals_plot.png')
-    
-    # Convert to base64 for API response
-    buf = io.BytesIO()
-    fig.savefig(buf, format='png')
-    buf.seek(0)
-    img_base64 = base64.b64encode(buf.read()).decode('utf-8')
-    plt.close(fig)
+    graph['image'] = save_figure(fig, subject_filename(state, 'vitals_plot.png'))
+    return graph
+
+def generate_risk_plot(state, include_image=True):
+    """Generate plot of risks over time"""
+    if len(state.history) < 2:
+        return not_enough_data(include_image)
     
-    vitals_data = {
-        'timestamps': [ts.isoformat() for ts in timestamps],
-        'body_temperature': body_temp,
-        'heart_rate': heart_rate,
-        'spo2': spo2
-    }
+    # Extract data (one copy of the history, so appends cannot shift the columns)
+    timestamps, columns = state.history.snapshot()
+    risk_values = columns["risk"]
+    statuses = [RISK_LABELS[int(code)] for code in columns["status"]]
     
-    return {
-        'image': img_base64,
-        'data': vitals_data
+    risk_data = {
+        'timestamps': timestamps_iso(timestamps),
+        'risk_values': risk_values.tolist(),
+        'statuses': statuses
     }
-
-def generate_risk_plot():
-    """Generate plot of risks over time"""
-    if len(risk_history) < 2:
-        return {'image': '', 'data': {'error': 'Not enough data points yet'}}
     
-    # Extract data
-    timestamps = [datetime.fromisoformat(item["timestamp"]) for item in risk_history]
-    risk_values = [item["Risk (%)"] for item in risk_history]
-    statuses = [item["Status"] for item in risk_history]
+    graph = {'data': risk_data}
+    if not include_image:
+        return graph
     
     # Determine color based on risk status
     colors = []
@@ -460,6 +395,8 @@ def generate_risk_plot():
             colors.append('green')
     
     # Create visualization
+    load_plotting()
+    timestamps = timestamps.astype('datetime64[us]')
     fig, ax = plt.subplots(figsize=(12, 6))
     
     # Plot line
@@ -483,90 +420,122 @@ def generate_risk_plot():
     # Format x-axis to show time properly
     fig.autofmt_xdate()
     
-    # Save offline copy
-    plt.tight_layout()
-    fig.savefig('static/graphs/risk_plot.png')
-    
-    # Convert to base64 for API response
-    buf = io.BytesIO()
-    fig.savefig(buf, format='png')
-    buf.seek(0)
-    img_base64 = base64.b64encode(buf.read()).decode('utf-8')
-    plt.close(fig)
-    
-    risk_data = {
-        'timestamps': [ts.isoformat() for ts in timestamps],
-        'risk_values': risk_values,
-        'statuses': statuses
-    }
-    
-    return {
-        'image': img_base64,
-        'data': risk_data
-    }
+    graph['image'] = save_figure(fig, subject_filename(state, 'risk_plot.png'))
+    return graph
+
+# ✅ Graph Cache Lookup
+# Graph name -> (generator, data sources it depends on). Graphs reading "risk"
+# or "vitals" are built from a subject's histories.
+GRAPHS = {
+    'feature_importance': (generate_feature_importance, ()),
+    'forecast_distribution': (generate_forecast_distribution, ("preds",)),
+    'trend': (generate_trend_rolling_mean, ("risk",)),
+    'volatility': (generate_volatility, ("risk",)),
+    'vitals': (generate_vitals_plot, ("vitals",)),
+    'risk': (generate_risk_plot, ("risk",))
+}
+
+def get_cached_graph(name, include_image=False, state=None):
+    """Return a graph, re-rendering it only if its input data has changed"""
+    generator, sources = GRAPHS[name]
+    per_subject = any(source in ("risk", "vitals") for source in sources)
+    versions = state.versions if per_subject else data_versions
+    cache = state.graphs if per_subject else graph_cache
+    key = (name, include_image)
+    
+    def lookup():
+        # Single dict reads and writes are atomic, so lookups take no lock
+        cached = cache.get(key)
+        if cached is not None and cached[0] == version:
+            GRAPH_CACHE.inc(name, "hit")
+            return cached[1]
+        return None
+    
+    def render():
+        GRAPH_CACHE.inc(name, "miss")
+        start = time.perf_counter()
+        graph = generator(state, include_image) if per_subject else generator(include_image)
+        GRAPH_RENDER_SECONDS.observe(time.perf_counter() - start, name, "image" if include_image else "data")
+        cache[key] = (version, graph)  # Replaces (evicts) the stale entry
+        return graph
+    
+    # Read the version before rendering so that data arriving mid-render
+    # leaves the entry stale and triggers another render next time
+    version = tuple(versions[source] for source in sources)
+    graph = lookup()
+    if graph is not None:
+        return graph
+    if not include_image:
+        return render()  # Data mode does not touch pyplot
+    with pyplot_lock:
+        # Another request may have rendered it while this one waited
+        graph = lookup()
+        return graph if graph is not None else render()
+
+def warm_graph_cache():
+    """Compute the graphs that only depend on startup data"""
+    # Images are rendered lazily on the first request that asks for them
+    for name in ('feature_importance', 'forecast_distribution'):
+        get_cached_graph(name)
 
 # ✅ Flask Endpoints
+# Ingestion and risk endpoints (/blynk_data, /risk_assessment, ...) are shared
+# with the slim ingestion-only server
+app.register_blueprint(ingestion)
+
 @app.route("/predictions", methods=["GET"])
 def get_predictions():
-    return jsonify(preds_df.to_dict(orient="records"))
-
-@app.route("/risk_assessment", methods=["GET"])
-def get_risk_assessment():
-    # Return the most recent risk assessment
-    return jsonify(last_risk_assessment)
-
-@app.route("/risk_history", methods=["GET"])
-def get_risk_history():
-    # Return the history of risk assessments
-    return jsonify(list(risk_history))
+    # A subject's latest re-forecast, falling back to the startup forecast
+    state = lookup_subject()
+    if state is None:
+        return unknown_subject()
+    forecast = subject_forecast(state)
+    if forecast is None:
+        return jsonify({"status": "error", "message": "Forecast not ready yet"}), 503
+    return jsonify(forecast.preds_df.to_dict(orient="records"))
 
 @app.route("/graph_data", methods=["GET"])
 def get_graph_data():
-    # Always generate all graphs - no options
-    all_graphs = {
-        'feature_importance': generate_feature_importance(),
-        'forecast_distribution': generate_forecast_distribution(),
-        'trend': generate_trend_rolling_mean(),
-        'volatility': generate_volatility(),
-        'vitals': generate_vitals_plot(),
-        'risk': generate_risk_plot()
-    }
-    return jsonify(all_graphs)
-
-@app.route("/blynk_data", methods=["POST"])
-def receive_blynk_data():
-    try:
-        # Update current vitals with the received data
-        global current_vitals, filtered_vitals
-        current_vitals.update(request.json)
-        
-        # Apply Kalman filtering to the raw vitals
-        filtered_vitals = filter_vitals(current_vitals)
-        
-        # Calculate risk with the filtered vitals
-        risk = calculate_heatstroke_risk(filtered_vitals)
-        
-        # Return both raw and filtered values along with risk
-        return jsonify({
-            "status": "success", 
-            "risk": risk,
-            "raw_vitals": current_vitals,
-            "filtered_vitals": filtered_vitals
-        }), 200
-    except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 400
-
-# Add endpoint to get the raw vs filtered data for visualization
-@app.route("/filter_data", methods=["GET"])
-def get_filter_data():
-    return jsonify({
-        "raw_values": raw_values,
-        "filtered_values": filtered_values
-    })
+    state = lookup_subject()
+    if state is None:
+        return unknown_subject()
+    
+    # mode=data (default) returns only the series and stats the dashboard
+    # plots itself; mode=image also returns the rendered PNGs
+    mode = request.args.get("mode", "data")
+    if mode not in ("data", "image"):
+        return jsonify({"status": "error", "message": f"Unknown mode: {mode}"}), 400
+    
+    # Optional comma-separated selector, e.g. ?graphs=trend,risk
+    selected = request.args.get("graphs")
+    names = selected.split(",") if selected else list(GRAPHS)
+    unknown = [name for name in names if name not in GRAPHS]
+    if unknown:
+        return jsonify({"status": "error", "message": f"Unknown graphs: {', '.join(unknown)}"}), 400
+    
+    # Serve graphs from the cache; only graphs with new data are recomputed
+    include_image = mode == "image"
+    start = time.perf_counter()
+    all_graphs = {name: get_cached_graph(name, include_image, state) for name in names}
+    built = time.perf_counter()
+    response = jsonify(all_graphs)
+    REQUEST_STAGE_SECONDS.observe(built - start, "/graph_data", "graphs")
+    REQUEST_STAGE_SECONDS.observe(time.perf_counter() - built, "/graph_data", "serialize")
+    return response
 
 if __name__ == "__main__":
-    # Initialize the Kalman filters
-    setup_kalman_filters()
+    # Initialize the Kalman filters, start the ingest workers and listen for binary frames
+    risk_engine.setup_kalman_filters()
+    pipeline.start()
+    frame_listener.start()
+    
+    # Render the static graphs once up front
+    warm_graph_cache()
+    
+    # Load the model without blocking startup, and keep each subject's
+    # forecast fresh off the request path once it is ready
+    load_model_in_background()
+    forecaster.start()
     
     # Run the Flask app
     app.run(debug=True, host="0.0.0.0", port=5001, use_reloader=False)
@@ -0,0 +1,136 @@
+"""Push risk assessments to dashboard clients as Server-Sent Events.
+
+Each recorded assessment is published once. It is serialized into an SSE
+frame once per event kind, however many clients are subscribed, and the
+same bytes are queued to every matching subscriber. Subscribers can follow
+one subject or all of them, and ask for full assessments or deltas (only
+what changed since the subject's previous assessment). A subscriber that
+falls behind has frames dropped and counted rather than slowing down the
+ingest workers.
+"""
+import itertools
+import json
+import queue
+import threading
+
+EVENT_KINDS = ("assessment", "delta")
+
+
+class Subscriber:
+    __slots__ = ("subject_id", "kind", "queue", "dropped")
+
+    def __init__(self, subject_id, kind, max_pending):
+        self.subject_id = subject_id  # None follows every subject
+        self.kind = kind
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.dropped = 0
+
+
+def assessment_delta(assessment, previous):
+    """The parts of an assessment that changed since the subject's previous one"""
+    delta = {"timestamp": assessment["timestamp"], "Risk (%)": assessment["Risk (%)"]}
+    if isinstance(previous.get("Risk (%)"), (int, float)):
+        delta["risk_change"] = round(assessment["Risk (%)"] - previous["Risk (%)"], 2)
+    if assessment["Status"] != previous.get("Status"):
+        delta["Status"] = assessment["Status"]
+    previous_vitals = previous.get("vitals", {})
+    vitals = {key: value for key, value in assessment["vitals"].items() if previous_vitals.get(key) != value}
+    if vitals:
+        delta["vitals"] = vitals
+    return delta
+
+
+class AssessmentBroadcaster:
+    """Fans published assessments out to SSE subscribers.
+
+    The subscriber collections are replaced whole on (un)subscribe, so
+    publish reads them without taking the lock.
+    """
+
+    def __init__(self, max_pending=1000, keepalive=15):
+        self.max_pending = max_pending  # Frames queued per subscriber before dropping
+        self.keepalive = keepalive  # Seconds between comment frames on an idle stream
+        self.published = 0  # Assessments sent to at least one subscriber
+        self.dropped = 0  # Frames dropped for slow subscribers since startup, including gone ones
+        self._all = ()  # Subscribers following every subject
+        self._by_subject = {}  # subject id -> subscribers following it
+        self._seq = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._all) + sum(len(subscribers) for subscribers in self._by_subject.values())
+
+    def subscribe(self, subject_id=None, kind="assessment"):
+        if kind not in EVENT_KINDS:
+            raise ValueError(f"Unknown event kind: {kind}")
+        subscriber = Subscriber(subject_id, kind, self.max_pending)
+        with self._lock:
+            if subject_id is None:
+                self._all = self._all + (subscriber,)
+            else:
+                by_subject = dict(self._by_subject)
+                by_subject[subject_id] = by_subject.get(subject_id, ()) + (subscriber,)
+                self._by_subject = by_subject
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            if subscriber.subject_id is None:
+                self._all = tuple(s for s in self._all if s is not subscriber)
+            else:
+                by_subject = dict(self._by_subject)
+                remaining = tuple(s for s in by_subject.get(subscriber.subject_id, ()) if s is not subscriber)
+                if remaining:
+                    by_subject[subscriber.subject_id] = remaining
+                else:
+                    by_subject.pop(subscriber.subject_id, None)
+                self._by_subject = by_subject
+
+    def publish(self, state, assessment, previous):
+        """Queue an assessment to its subscribers (a risk_engine assessment listener)"""
+        subscribers = self._all + self._by_subject.get(state.subject_id, ())
+        if not subscribers:
+            return
+        seq = next(self._seq)
+        frames = {}  # Event kind -> encoded frame, built once for all subscribers
+        for subscriber in subscribers:
+            frame = frames.get(subscriber.kind)
+            if frame is None:
+                if subscriber.kind == "delta":
+                    data = assessment_delta(assessment, previous)
+                else:
+                    data = assessment
+                body = json.dumps({"subject_id": state.subject_id, **data})
+                frame = frames[subscriber.kind] = f"id: {seq}\nevent: {subscriber.kind}\ndata: {body}\n\n".encode()
+            try:
+                subscriber.queue.put_nowait(frame)
+            except queue.Full:
+                subscriber.dropped += 1
+                with self._lock:  # Several ingest workers publish at once
+                    self.dropped += 1
+        self.published = seq
+
+    def events(self, subject_id=None, kind="assessment"):
+        """SSE frames for a new subscriber until the client disconnects"""
+        # Subscribing inside the generator ties the subscription to the
+        # response body, which the server closes when the client goes away
+        subscriber = self.subscribe(subject_id, kind)
+        try:
+            yield b": connected\n\n"
+            while True:
+                try:
+                    yield subscriber.queue.get(timeout=self.keepalive)
+                except queue.Empty:
+                    yield b": keepalive\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self):
+        subscribers = self._all + tuple(itertools.chain.from_iterable(self._by_subject.values()))
+        return {
+            "subscribers": len(subscribers),
+            "published": self.published,
+            "dropped": self.dropped,
+            # Drops of the subscribers connected now; resets as they leave
+            "dropped_connected": sum(subscriber.dropped for subscriber in subscribers)
+        }
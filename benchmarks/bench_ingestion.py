@@ -0,0 +1,259 @@
+"""Latency and throughput of the ingestion, risk and graph paths.
+
+Micro-benchmarks of filter_vitals, filter_vitals_batch, score_vitals,
+calculate_heatstroke_risk and ingest_batch, then end-to-end readings/sec and
+p50/p99 latency of /blynk_data, /blynk_data/batch and /blynk_data/binary
+through the Flask test client, then the cost of /graph_data with cached, invalidated and rendered
+graphs. Readings come from the synthetic VitalStream, so runs are
+reproducible. Everything runs offline on the CPU. The assessments are
+stored in a temporary history database, removed on exit.
+
+/graph_data needs the full server, which loads processed_data.csv from the
+working directory; it is skipped if Tft_Forecast cannot be imported.
+
+Run from the repository root:
+    python benchmarks/bench_ingestion.py --json bench.json
+    python benchmarks/bench_ingestion.py --compare bench.json  # exit 1 on regressions
+"""
+import argparse
+import atexit
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+# Synthetic assessments go to a throwaway history database, never the server's
+HISTORY_DIR = tempfile.mkdtemp(prefix="bench-history-")
+os.environ["HEATSTROKE_HISTORY_PATH"] = os.path.join(HISTORY_DIR, "history.sqlite3")
+atexit.register(shutil.rmtree, HISTORY_DIR, ignore_errors=True)
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import risk_engine
+from vital_stream import VITAL_KEYS, VitalStream, load_profile
+
+# Metric name -> (value, unit, higher is better)
+results = {}
+
+
+def report(name, value, unit, higher_is_better=False):
+    results[name] = (value, unit, higher_is_better)
+    print(f"{name:<44} {value:>12.2f} {unit}")
+
+
+def per_call_us(fn, n, repeats=3):
+    """Best-of-`repeats` mean time of fn(i) over n calls, in microseconds"""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for i in range(n):
+            fn(i)
+        best = min(best, time.perf_counter() - start)
+    return best / n * 1e6
+
+
+def percentiles_ms(samples):
+    return np.percentile(np.asarray(samples) * 1e3, [50, 99])
+
+
+def as_triple(reading):
+    """(subject id, timestamp, vitals) of a VitalStream reading, for ingest_batch"""
+    reading = dict(reading)
+    return reading.pop("subject_id"), risk_engine.parse_timestamp(reading.pop("timestamp")), reading
+
+
+def as_frames(readings):
+    """Packed binary frames of VitalStream readings, for /blynk_data/binary"""
+    from binary_ingest import encode_frames
+
+    vitals = np.full((len(readings), 6), np.nan)
+    for row, reading in enumerate(readings):
+        vitals[row, :len(VITAL_KEYS)] = [reading.get(vital_key, np.nan) for vital_key in VITAL_KEYS]
+    timestamps = [datetime.fromisoformat(reading["timestamp"]).timestamp() for reading in readings]
+    return encode_frames([reading["subject_id"] for reading in readings], timestamps, vitals)
+
+
+def bench_micro(stream, n):
+    risk_engine.setup_kalman_filters()
+    state = risk_engine.subjects.get("micro")
+    values = stream.next_values()
+    readings = [dict(zip(VITAL_KEYS, row.tolist())) for row in values]
+    now = datetime.now()
+
+    report("filter_vitals (us/reading)",
+           per_call_us(lambda i: risk_engine.filter_vitals(readings[i % len(readings)], state, now), n), "us")
+    report("calculate_heatstroke_risk (us/reading)",
+           per_call_us(lambda i: risk_engine.calculate_heatstroke_risk(readings[i % len(readings)], state, now), n),
+           "us")
+    report("score_vitals, 1 row (us/call)", per_call_us(lambda i: risk_engine.score_vitals(values[:1], 37.0), n), "us")
+    report("score_vitals, vectorized (us/reading)",
+           per_call_us(lambda i: risk_engine.score_vitals(values, 37.0), max(1, n // 100)) / len(values), "us")
+
+    states = [risk_engine.subjects.get(f"micro-{i}") for i in range(len(readings))]
+    batch = [(state, reading, now) for state, reading in zip(states, readings)]
+    report("filter_vitals_batch (us/reading)",
+           per_call_us(lambda i: risk_engine.filter_vitals_batch(batch), max(1, n // 100)) / len(batch), "us")
+    triples = [(f"micro-{i}", now, reading) for i, reading in enumerate(readings)]
+    report("ingest_batch (us/reading)",
+           per_call_us(lambda i: risk_engine.ingest_batch(triples), max(1, n // 100)) / len(triples), "us")
+
+
+def bench_end_to_end(stream, n_steps, batch_size):
+    import ingestion_server
+    from ingestion_server import pipeline
+
+    risk_engine.setup_kalman_filters()
+    client = ingestion_server.app.test_client()
+    pipeline.start()
+
+    # Time from POST to recorded assessment, matched per subject in order
+    submitted, done = {}, {}
+    def on_assessment(state, assessment, previous):
+        done.setdefault(state.subject_id, []).append(time.perf_counter())
+    risk_engine.assessment_listeners.append(on_assessment)
+    try:
+        readings = list(stream.readings(n_steps))
+        http = []
+        start = time.perf_counter()
+        for reading in readings:
+            sent = time.perf_counter()
+            response = client.post("/blynk_data", json=reading)
+            http.append(time.perf_counter() - sent)
+            if response.status_code == 202:
+                submitted.setdefault(reading["subject_id"], []).append(sent)
+        pipeline.flush()
+        elapsed = time.perf_counter() - start
+        lag = [end - begin for subject_id, times in submitted.items()
+               for begin, end in zip(times, done.get(subject_id, []))]
+
+        report("/blynk_data throughput (readings/s)", len(readings) / elapsed, "/s", True)
+        p50, p99 = percentiles_ms(http)
+        report("/blynk_data response p50 (ms)", p50, "ms")
+        report("/blynk_data response p99 (ms)", p99, "ms")
+        p50, p99 = percentiles_ms(lag)
+        report("/blynk_data to assessment p50 (ms)", p50, "ms")
+        report("/blynk_data to assessment p99 (ms)", p99, "ms")
+
+        readings = list(stream.readings(n_steps))
+        chunks = [readings[i:i + batch_size] for i in range(0, len(readings), batch_size)]
+        http = []
+        start = time.perf_counter()
+        for chunk in chunks:
+            sent = time.perf_counter()
+            client.post("/blynk_data/batch", json={"readings": chunk})
+            http.append(time.perf_counter() - sent)
+        pipeline.flush()
+        elapsed = time.perf_counter() - start
+        report(f"/blynk_data/batch x{batch_size} throughput (readings/s)", len(readings) / elapsed, "/s", True)
+        p50, p99 = percentiles_ms(http)
+        report(f"/blynk_data/batch x{batch_size} response p99 (ms)", p99, "ms")
+
+        readings = list(stream.readings(n_steps))
+        bodies = [as_frames(readings[i:i + batch_size]) for i in range(0, len(readings), batch_size)]
+        http = []
+        start = time.perf_counter()
+        for body in bodies:
+            sent = time.perf_counter()
+            client.post("/blynk_data/binary", data=body, content_type="application/octet-stream")
+            http.append(time.perf_counter() - sent)
+        pipeline.flush()
+        elapsed = time.perf_counter() - start
+        report(f"/blynk_data/binary x{batch_size} throughput (readings/s)", len(readings) / elapsed, "/s", True)
+        p50, p99 = percentiles_ms(http)
+        report(f"/blynk_data/binary x{batch_size} response p99 (ms)", p99, "ms")
+    finally:
+        risk_engine.assessment_listeners.remove(on_assessment)
+        pipeline.stop()
+
+
+def bench_graph_data(stream, repeats):
+    try:
+        import Tft_Forecast
+    except Exception as e:
+        print(f"/graph_data skipped: {e}")
+        return
+
+    risk_engine.setup_kalman_filters()
+    client = Tft_Forecast.app.test_client()
+    subject_id = stream.subject_ids[0]
+    # Fill the subject's history
+    risk_engine.ingest_batch([as_triple(reading) for reading in stream.readings(100)])
+
+    def timed_get(path, invalidate):
+        samples = []
+        for _ in range(repeats):
+            if invalidate:
+                # One new reading invalidates the subject's cached graphs
+                risk_engine.ingest_batch([as_triple(reading) for reading in stream.readings(1)
+                                          if reading["subject_id"] == subject_id])
+            start = time.perf_counter()
+            client.get(path)
+            samples.append(time.perf_counter() - start)
+        return float(np.median(samples)) * 1e3
+
+    path = f"/graph_data?subject_id={subject_id}"
+    timed_get(path + "&mode=image", True)  # Warm up the plotting import
+    report("/graph_data data, cached (ms)", timed_get(path, False), "ms")
+    report("/graph_data data, new reading (ms)", timed_get(path, True), "ms")
+    report("/graph_data image, cached (ms)", timed_get(path + "&mode=image", False), "ms")
+    report("/graph_data image, new reading (ms)", timed_get(path + "&mode=image", True), "ms")
+    for name in ("trend", "volatility", "vitals", "risk"):
+        report(f"/graph_data image {name}, new reading (ms)",
+               timed_get(f"{path}&mode=image&graphs={name}", True), "ms")
+
+
+def compare(baseline_path, tolerance):
+    """Print metrics worse than the baseline by more than tolerance; returns their count"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = 0
+    for name, (value, unit, higher_is_better) in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]["value"]
+        change = (before - value) / before if higher_is_better else (value - before) / before
+        if change > tolerance:
+            regressions += 1
+            print(f"REGRESSION {name}: {before:.2f} -> {value:.2f} {unit} ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profile", default=None, help="processed_data.csv or predictions.json to draw vitals from")
+    parser.add_argument("--subjects", type=int, default=100)
+    parser.add_argument("--steps", type=int, default=20, help="readings per subject in the end-to-end runs")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--calls", type=int, default=2000, help="calls per micro-benchmark")
+    parser.add_argument("--repeats", type=int, default=20, help="requests per /graph_data case")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip", nargs="*", default=[], choices=["micro", "end-to-end", "graph"])
+    parser.add_argument("--json", help="write the results here")
+    parser.add_argument("--compare", help="baseline results to check against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before failing")
+    args = parser.parse_args()
+
+    profile = load_profile(args.profile)
+    stream = VitalStream(args.subjects, seed=args.seed, profile=profile)
+    if "micro" not in args.skip:
+        bench_micro(stream, args.calls)
+    if "end-to-end" not in args.skip:
+        bench_end_to_end(stream, args.steps, args.batch_size)
+    if "graph" not in args.skip:
+        bench_graph_data(stream, args.repeats)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({name: {"value": value, "unit": unit, "higher_is_better": higher}
+                       for name, (value, unit, higher) in results.items()}, f, indent=2)
+    if args.compare and compare(args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
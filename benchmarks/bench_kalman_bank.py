@@ -0,0 +1,113 @@
+"""Throughput of the vectorized Kalman filter bank.
+
+Checks the bank against per-vital filterpy filters (when filterpy is
+installed), then reports readings/sec at 1, 100 and 10k subjects, next to the
+old one-filterpy-object-per-vital loop.
+
+Run from the repository root:
+    python benchmarks/bench_kalman_bank.py
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from kalman_bank import KalmanFilterBank
+from risk_engine import kf_settings
+
+try:
+    from filterpy.kalman import KalmanFilter
+except ImportError:
+    KalmanFilter = None
+
+# The server's per-vital filter settings (risk_engine only needs NumPy)
+Q = [np.array(setting["Q"]) for setting in kf_settings]
+R = [setting["R"] for setting in kf_settings]
+MEANS = np.array([32.0, 60.0, 37.5, 97.0, 90.0])
+NOISE = np.array([0.5, 3.0, 0.4, 1.0, 8.0])
+
+
+def make_readings(n_steps, n_subjects, missing_rate=0.0, seed=0):
+    rng = np.random.default_rng(seed)
+    z = MEANS + rng.normal(size=(n_steps, n_subjects, len(R))) * NOISE
+    if missing_rate:
+        z[rng.random(z.shape) < missing_rate] = np.nan
+    return z
+
+
+def make_filterpy_filters():
+    filters = []
+    for q, r in zip(Q, R):
+        f = KalmanFilter(dim_x=2, dim_z=1)
+        f.x = np.array([[0.], [0.]])
+        f.F = np.array([[1., 1.], [0., 1.]])
+        f.H = np.array([[1., 0.]])
+        f.P *= 1e6
+        f.R = r
+        f.Q = q
+        filters.append(f)
+    return filters
+
+
+def check_against_filterpy(n_steps=500):
+    z = make_readings(n_steps, 1, missing_rate=0.1)[:, 0, :]
+    bank = KalmanFilterBank(Q, R, n_subjects=1, initial_uncertainty=1e6)
+    filters = make_filterpy_filters()
+    worst = 0.0
+    for row in z:
+        positions = bank.step(row)[0]
+        for i, f in enumerate(filters):
+            f.predict()
+            f.update(None if np.isnan(row[i]) else row[i])
+            worst = max(worst, abs(positions[i] - f.x[0, 0]))
+    return worst
+
+
+def bench_bank(n_subjects, n_steps):
+    z = make_readings(n_steps, n_subjects)
+    bank = KalmanFilterBank(Q, R, n_subjects=n_subjects, initial_uncertainty=1e6)
+    start = time.perf_counter()
+    for row in z:
+        bank.step(row)
+    elapsed = time.perf_counter() - start
+    return n_steps * n_subjects / elapsed
+
+
+def bench_filterpy_loop(n_subjects, n_steps):
+    z = make_readings(n_steps, n_subjects)
+    subjects = [make_filterpy_filters() for _ in range(n_subjects)]
+    start = time.perf_counter()
+    for row in z:
+        for filters, readings in zip(subjects, row):
+            for f, value in zip(filters, readings):
+                f.predict()
+                f.update(value)
+    elapsed = time.perf_counter() - start
+    return n_steps * n_subjects / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--subjects", type=int, nargs="+", default=[1, 100, 10000])
+    parser.add_argument("--steps", type=int, default=200)
+    args = parser.parse_args()
+
+    if KalmanFilter is not None:
+        print(f"max |bank - filterpy| over 500 steps: {check_against_filterpy():.3e}")
+
+    print(f"{'subjects':>10} {'bank readings/s':>18} {'filterpy readings/s':>20}")
+    for n_subjects in args.subjects:
+        bank_rate = bench_bank(n_subjects, args.steps)
+        # The per-object loop is far too slow to run at full size
+        if KalmanFilter is not None and n_subjects <= 100:
+            loop_rate = f"{bench_filterpy_loop(n_subjects, max(args.steps // 10, 1)):,.0f}"
+        else:
+            loop_rate = "-"
+        print(f"{n_subjects:>10} {bank_rate:>18,.0f} {loop_rate:>20}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Forecast throughput of batched TFT inference versus batch size.
+
+Builds synthetic per-subject input windows from the training dataset and
+compares one model.predict call per series against predict_batch (a single
+call over all series) at several batch sizes. CPU only.
+
+Run from the repository root (needs processed_data.csv and tft_model.pth):
+    python benchmarks/bench_tft_batch.py --subjects 256
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+from darts import TimeSeries
+from darts.dataprocessing.transformers import Scaler
+from darts.models import TFTModel
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from forecasting import load_dataset, predict_batch
+
+
+def make_windows(df, n_subjects, length, seed=0):
+    """Random input windows of the dataset, one per synthetic subject"""
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp.now().floor("h")
+    index = pd.date_range(end=end, periods=length, freq="h", name=df.index.name)
+    windows = {}
+    for i, start in enumerate(rng.integers(0, len(df) - length, size=n_subjects)):
+        window = df.iloc[start:start + length].copy()
+        window.index = index
+        windows[f"subject-{i}"] = window
+    return windows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data", default="processed_data.csv")
+    parser.add_argument("--model", default="tft_model.pth")
+    parser.add_argument("--subjects", type=int, default=256)
+    parser.add_argument("--horizon", type=int, default=24)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 128, 512])
+    parser.add_argument("--threads", type=int, default=None, help="torch CPU threads")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    df = load_dataset(args.data)
+    scaler = Scaler()
+    scaler.fit(TimeSeries.from_dataframe(df, value_cols=df.columns))
+    model = TFTModel.load(args.model, map_location="cpu")
+    windows = make_windows(df, args.subjects, model.input_chunk_length)
+
+    # Warm up (first call builds the trainer / dataloaders)
+    predict_batch(model, dict(list(windows.items())[:1]), scaler, args.horizon)
+
+    # Baseline: one predict call per subject (only a sample, it is slow)
+    sample = dict(list(windows.items())[:min(32, args.subjects)])
+    start = time.perf_counter()
+    for subject_id, window in sample.items():
+        predict_batch(model, {subject_id: window}, scaler, args.horizon)
+    per_series_rate = len(sample) / (time.perf_counter() - start)
+    print(f"{'one call per series':>22}: {per_series_rate:10.1f} forecasts/s")
+
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        predict_batch(model, windows, scaler, args.horizon, batch_size=batch_size)
+        rate = len(windows) / (time.perf_counter() - start)
+        print(f"{f'batch_size={batch_size}':>22}: {rate:10.1f} forecasts/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Import time and resident memory of the server profiles and their dependencies.
+
+Each module is imported in a fresh interpreter, so every number includes the
+module's own dependencies and nothing imported before it. Reports the wall
+time of the import and the process's peak RSS afterwards, e.g. to compare the
+slim ingestion_server profile against the full Tft_Forecast server.
+
+Run from the repository root:
+    python benchmarks/startup_profile.py
+    python benchmarks/startup_profile.py --modules ingestion_server Tft_Forecast
+
+Tft_Forecast loads processed_data.csv from the working directory on import;
+pass --data-dir if the dataset lives elsewhere.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    "numpy", "flask", "pandas", "darts", "torch", "matplotlib.pyplot", "seaborn",
+    "risk_engine", "ingestion_server", "forecasting", "Tft_Forecast",
+]
+
+# Runs in the child interpreter; prints {"seconds": ..., "rss_mb": ...}
+PROBE = """
+import importlib, json, resource, sys, time
+start = time.perf_counter()
+importlib.import_module(sys.argv[1])
+seconds = time.perf_counter() - start
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # KiB on Linux
+print(json.dumps({"seconds": seconds, "rss_mb": rss_kb / 1024}))
+"""
+
+
+def profile_import(module, repeats=3, data_dir=ROOT):
+    """Best-of-`repeats` import time and peak RSS of importing module alone"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+    best = None
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, "-c", PROBE, module], cwd=data_dir, env=env,
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            return None
+        sample = json.loads(result.stdout.strip().splitlines()[-1])
+        if best is None or sample["seconds"] < best["seconds"]:
+            best = sample
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modules", nargs="+", default=MODULES)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--data-dir", default=ROOT, help="working directory holding processed_data.csv")
+    args = parser.parse_args()
+
+    baseline = profile_import("sys", 1)
+    print(f"interpreter baseline: {baseline['rss_mb']:.1f} MB")
+    print(f"{'module':<20} {'import (s)':>10} {'peak RSS (MB)':>14}")
+    for module in args.modules:
+        sample = profile_import(module, args.repeats, args.data_dir)
+        if sample is None:
+            print(f"{module:<20} {'not importable':>25}")
+            continue
+        print(f"{module:<20} {sample['seconds']:>10.3f} {sample['rss_mb']:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Synthetic vital-sign streams for benchmarks.
+
+Readings follow per-subject AR(1) walks around the mean of each vital, with
+the spread taken from processed_data.csv or predictions.json when one is
+given (built-in values otherwise, so benchmarks run without the data
+files). Some subjects drift into heat stress, so every risk status is
+exercised. The output is deterministic for a given seed.
+"""
+import csv
+import json
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Live vital -> dataset column (processed_data.csv / predictions.json)
+VITAL_COLUMNS = {
+    "V0": "Temperature (°C)",
+    "V1": "Relative Humidity (%)",
+    "V2": "Body Temperature (°C)",
+    "V3": "SpO2 (%)",
+    "V4": "Heart Rate (bpm)",
+}
+VITAL_KEYS = list(VITAL_COLUMNS)
+
+# (mean, std) per vital, roughly those of processed_data.csv
+DEFAULT_PROFILE = {
+    "V0": (30.0, 4.0),
+    "V1": (65.0, 12.0),
+    "V2": (37.5, 1.2),
+    "V3": (96.5, 1.5),
+    "V4": (105.0, 20.0),
+}
+
+
+def load_profile(path=None):
+    """Per-vital (mean, std) from a processed_data.csv or predictions.json file.
+
+    Vitals missing from the file (predictions.json has no SpO2) keep their
+    default profile.
+    """
+    profile = dict(DEFAULT_PROFILE)
+    if path is None:
+        return profile
+    if path.endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            rows = list(json.load(f).values())
+    else:
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+    for vital_key, column in VITAL_COLUMNS.items():
+        values = np.array([float(row[column]) for row in rows if row.get(column) not in (None, "")])
+        if len(values) > 1:
+            profile[vital_key] = (float(values.mean()), float(values.std()))
+    return profile
+
+
+class VitalStream:
+    """Deterministic readings for n_subjects wearers, one reading each per step"""
+
+    def __init__(self, n_subjects=1, seed=0, profile=None, missing_rate=0.0, stressed_share=0.2,
+                 interval=1.0, start=datetime(2024, 11, 1)):
+        profile = profile or DEFAULT_PROFILE
+        self.n_subjects = n_subjects
+        self.missing_rate = missing_rate  # Share of vitals left out of a reading
+        self.interval = interval  # Seconds between a subject's readings
+        self.start = start
+        self.subject_ids = [f"subject-{i}" for i in range(n_subjects)]
+        self.mean = np.array([profile[vital_key][0] for vital_key in VITAL_KEYS])
+        self.std = np.array([profile[vital_key][1] for vital_key in VITAL_KEYS])
+        self._rng = np.random.default_rng(seed)
+        self._level = self.mean + self._rng.normal(size=(n_subjects, len(VITAL_KEYS))) * self.std * 0.5
+        # Stressed subjects drift towards high ambient / body temperature and heart rate
+        drift = np.array([0.02, 0.0, 0.004, -0.003, 0.08])
+        self._drift = np.where(self._rng.random((n_subjects, 1)) < stressed_share, drift, 0.0)
+        self._step = 0
+
+    def next_values(self):
+        """(n_subjects, 5) array with the next reading of every subject (NaN = missing)"""
+        noise = self._rng.normal(size=self._level.shape) * self.std * 0.05
+        self._level = self.mean + 0.98 * (self._level - self.mean) + noise + self._drift * self.std
+        values = self._level.copy()
+        if self.missing_rate:
+            values[self._rng.random(values.shape) < self.missing_rate] = np.nan
+        self._step += 1
+        return values
+
+    def readings(self, n_steps):
+        """Yield n_steps rounds of reading dicts, as posted to /blynk_data"""
+        for _ in range(n_steps):
+            timestamp = (self.start + timedelta(seconds=self._step * self.interval)).isoformat()
+            for subject_id, row in zip(self.subject_ids, self.next_values()):
+                reading = {"subject_id": subject_id, "timestamp": timestamp}
+                reading.update({vital_key: round(float(value), 3)
+                                for vital_key, value in zip(VITAL_KEYS, row) if not np.isnan(value)})
+                yield reading
@@ -0,0 +1,173 @@
+"""Compact binary ingestion for sensor gateways.
+
+A JSON reading is parsed into a dict at every hop, which costs far more than
+its six floats. Here, gateways send packed frames instead:
+
+    struct "<16sd6f" (48 bytes, little-endian)
+      subject_id  16 bytes UTF-8, NUL-padded (empty: the default subject)
+      timestamp   float64 epoch seconds (0: time of receipt)
+      V0-V5       6 x float32 (NaN: not sent, the last value is kept)
+
+Any number of frames can be concatenated, so a buffer's size is always a
+multiple of 48 bytes. A whole buffer is decoded with one np.frombuffer call
+into a (n, 6) float array, which is queued on the ingest pipeline as one
+block per shard. The workers merge a block into the filter input with array
+operations. A buffer with an out-of-range timestamp or an infinite vital
+is rejected whole.
+
+Frames are accepted:
+  - over HTTP, POSTed to /blynk_data/binary as application/octet-stream,
+    or as application/msgpack, which needs the msgpack package: a list of
+    [subject_id, timestamp, [V0, ..., V5]] with nil for values not sent,
+  - by FrameListener, on a UDP port (one or more frames per datagram) and
+    a TCP port (a stream of frames) of the same number.
+"""
+import socketserver
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+import metrics
+from risk_engine import ReadingBlock
+from subjects import DEFAULT_SUBJECT
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+FRAME = np.dtype([("subject_id", "S16"), ("timestamp", "<f8"), ("vitals", "<f4", (6,))])
+FRAME_SIZE = FRAME.itemsize
+MAX_DATAGRAM = 65507  # Largest UDP payload, 1364 frames
+MAX_SECONDS = datetime(9999, 1, 1).timestamp()  # Latest timestamp a datetime can hold, with a margin
+
+FRAMES = metrics.Counter(
+    "heatstroke_binary_frames_total", "Binary frames received, by transport and outcome",
+    ("transport", "outcome")
+)
+
+
+def encode_frames(subject_ids, timestamps, vitals):
+    """Pack readings into frames (for gateways, tests and benchmarks)"""
+    frames = np.zeros(len(subject_ids), dtype=FRAME)
+    frames["subject_id"] = [subject_id.encode() for subject_id in subject_ids]
+    frames["timestamp"] = timestamps
+    frames["vitals"] = vitals
+    return frames.tobytes()
+
+
+def decode_frames(data):
+    """(subject ids, epoch seconds, (n, 6) vitals) of a buffer of frames"""
+    if len(data) % FRAME_SIZE:
+        raise ValueError(f"Binary body must be a multiple of {FRAME_SIZE} bytes, got {len(data)}")
+    frames = np.frombuffer(data, dtype=FRAME)
+    subject_ids = np.char.decode(frames["subject_id"], "utf-8").tolist()
+    return validate(subject_ids, frames["timestamp"].astype(float), frames["vitals"].astype(float))
+
+
+def decode_msgpack(data):
+    """(subject ids, epoch seconds, (n, 6) vitals) of a MessagePack list of readings"""
+    if msgpack is None:
+        raise ValueError("MessagePack ingestion needs the msgpack package")
+    readings = msgpack.unpackb(data)
+    try:
+        subject_ids = [str(subject_id or "") for subject_id, _, _ in readings]
+        seconds = np.array([timestamp or 0 for _, timestamp, _ in readings], dtype=float)
+        vitals = np.array([[np.nan if value is None else value for value in values] for _, _, values in readings],
+                          dtype=float).reshape(len(readings), 6)
+    except (TypeError, ValueError):
+        raise ValueError("MessagePack body must be a list of [subject_id, timestamp, [V0, ..., V5]]")
+    return validate(subject_ids, seconds, vitals)
+
+
+def validate(subject_ids, seconds, vitals):
+    if np.isinf(vitals).any() or not np.isfinite(seconds).all():
+        raise ValueError("Vitals and timestamps must be finite")
+    if ((seconds < 0) | (seconds > MAX_SECONDS)).any():
+        raise ValueError(f"Timestamps must be epoch seconds between 0 and {MAX_SECONDS:.0f}")
+    return [subject_id or DEFAULT_SUBJECT for subject_id in subject_ids], seconds, vitals
+
+
+def queue_readings(pipeline, subject_ids, seconds, vitals):
+    """Queue decoded readings as blocks, one per shard; returns (accepted, dropped)
+
+    The workers process each block in one micro-batch, in timestamp order.
+    """
+    seconds = np.where(seconds > 0, seconds, time.time())
+    dropped = pipeline.submit_block(ReadingBlock(subject_ids, seconds, vitals))
+    return len(subject_ids) - dropped, dropped
+
+
+def count(transport, accepted, dropped):
+    if accepted:
+        FRAMES.inc(transport, "accepted", amount=accepted)
+    if dropped:
+        FRAMES.inc(transport, "dropped", amount=dropped)
+
+
+class DatagramHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.server.listener.receive(self.request[0], "udp")
+
+
+class StreamHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        pending = b""
+        while True:
+            chunk = self.request.recv(1 << 16)
+            if not chunk:
+                break
+            pending += chunk
+            complete = len(pending) - len(pending) % FRAME_SIZE
+            if complete:
+                self.server.listener.receive(pending[:complete], "tcp")
+                pending = pending[complete:]
+
+
+class FrameUDPServer(socketserver.UDPServer):
+    max_packet_size = MAX_DATAGRAM
+
+
+class FrameTCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class FrameListener:
+    """UDP and TCP listeners queuing binary frames on an ingest pipeline.
+
+    Datagrams are handled one at a time by a single thread; each TCP
+    connection gets its own thread. A datagram with a malformed frame is
+    dropped whole and counted as rejected.
+    """
+
+    def __init__(self, pipeline, host="0.0.0.0", port=5002):
+        self.pipeline = pipeline
+        self.host = host
+        self.port = port  # Same number for UDP and TCP
+        self._servers = []
+
+    def receive(self, data, transport):
+        try:
+            readings = decode_frames(data)
+        except ValueError:
+            FRAMES.inc(transport, "rejected", amount=max(1, len(data) // FRAME_SIZE))
+            return
+        count(transport, *queue_readings(self.pipeline, *readings))
+
+    def start(self):
+        if self._servers:
+            return
+        self._servers = [FrameUDPServer((self.host, self.port), DatagramHandler),
+                         FrameTCPServer((self.host, self.port), StreamHandler)]
+        for server, transport in zip(self._servers, ("udp", "tcp")):
+            server.listener = self
+            threading.Thread(target=server.serve_forever, name=f"frames-{transport}", daemon=True).start()
+
+    def stop(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers = []
@@ -0,0 +1,412 @@
+"""Rolling TFT re-forecasting for live subjects.
+
+The startup forecast in Tft_Forecast.py is made once from the training data.
+ForecastService runs off the request path in a background thread and
+periodically re-predicts each subject's next hours from hourly means of the
+subject's own filtered vitals (see ForecastService.build_window). Finished
+forecasts are swapped in atomically, so readers always see a complete
+forecast. Forecasts are cached by their scaled input window, so unchanged
+windows do not re-run the model.
+
+Forecasts carry the TFT's quantile outputs per horizon step. The interval
+band the risk engine scores against and the summary statistics served to
+the dashboard are computed once per forecast.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from darts import TimeSeries
+from darts.dataprocessing.transformers import Scaler
+
+from ring_buffer import to_timestamp_us
+
+# Live vital -> dataset column it is substituted into
+LIVE_COLUMNS = {
+    "V0": "Temperature (°C)",
+    "V1": "Relative Humidity (%)",
+    "V2": "Body Temperature (°C)",
+    "V4": "Heart Rate (bpm)",
+}
+
+
+def load_dataset(csv_path="processed_data.csv"):
+    """Read the sensor dataset as a cleaned, gap-free hourly frame"""
+    df = pd.read_csv(csv_path, parse_dates=["Time of Reading"])
+    df.drop(columns=["UV Index"], errors="ignore", inplace=True)
+    df = df.groupby("Time of Reading").mean().reset_index()
+    df = df.sort_values("Time of Reading").set_index("Time of Reading").asfreq("h").interpolate()
+    df.fillna(method="ffill", inplace=True)
+    df.fillna(method="bfill", inplace=True)
+    return df
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_dataset_snapshot(csv_path="processed_data.csv", snapshot_path=".cache/processed_data.npz"):
+    """Cleaned hourly frame and per-column (min, max), from an NPZ snapshot when fresh.
+
+    The snapshot is keyed by the CSV's size and mtime. If those changed but
+    the content hash did not (e.g. the file was copied), the snapshot is
+    reused and re-keyed. Otherwise the CSV is cleaned again and the snapshot
+    rewritten.
+    """
+    stat = os.stat(csv_path)
+    csv_hash = None
+    if os.path.exists(snapshot_path):
+        with np.load(snapshot_path, allow_pickle=False) as snapshot:
+            cached = {key: snapshot[key] for key in snapshot.files}
+        fresh = cached["csv_size"] == stat.st_size and cached["csv_mtime_ns"] == stat.st_mtime_ns
+        if not fresh:
+            csv_hash = file_sha256(csv_path)
+            fresh = str(cached["csv_sha256"]) == csv_hash
+        if fresh:
+            df = pd.DataFrame(
+                cached["values"], columns=cached["columns"].tolist(),
+                index=pd.DatetimeIndex(cached["index"].astype("datetime64[ns]"), freq="h",
+                                       name=str(cached["index_name"]))
+            )
+            if csv_hash is not None:
+                save_dataset_snapshot(snapshot_path, df, stat, csv_hash)
+            return df, (cached["data_min"], cached["data_max"])
+
+    df = load_dataset(csv_path)
+    save_dataset_snapshot(snapshot_path, df, stat, csv_hash or file_sha256(csv_path))
+    return df, (df.min().to_numpy(), df.max().to_numpy())
+
+
+def save_dataset_snapshot(snapshot_path, df, stat, csv_hash):
+    os.makedirs(os.path.dirname(snapshot_path) or ".", exist_ok=True)
+    # Write to a temporary file and rename so readers never see a partial file
+    tmp_path = snapshot_path + ".tmp.npz"
+    np.savez(
+        tmp_path,
+        index=df.index.asi8, values=df.to_numpy(dtype=float), columns=np.array(df.columns, dtype=str),
+        index_name=np.array(df.index.name or ""), data_min=df.min().to_numpy(), data_max=df.max().to_numpy(),
+        csv_size=stat.st_size, csv_mtime_ns=stat.st_mtime_ns, csv_sha256=np.array(csv_hash)
+    )
+    os.replace(tmp_path, snapshot_path)
+
+
+def make_scaler(columns, bounds):
+    """Fitted min-max Scaler rebuilt from per-column (min, max) bounds.
+
+    Fitting on a two-row series of the column minima and maxima gives the
+    same scaling as fitting on the full dataset, at a fraction of the cost.
+    """
+    data_min, data_max = bounds
+    extremes = pd.DataFrame([data_min, data_max], columns=columns,
+                            index=pd.date_range("2000-01-01", periods=2, freq="h"))
+    scaler = Scaler()
+    scaler.fit(TimeSeries.from_dataframe(extremes, value_cols=columns))
+    return scaler
+
+
+# Quantile levels of the interval band the risk engine scores readings against
+BAND = (0.1, 0.9)
+
+
+def nearest_level(levels, level):
+    """Index of the quantile level closest to level"""
+    return int(np.argmin(np.abs(np.asarray(levels) - level)))
+
+
+class Forecast:
+    """One forecast with the summaries the risk engine reads precomputed.
+
+    preds_df holds the point (median) forecast. horizon maps each column to
+    its per-step values; mean, min and max map each column to a float.
+    quantiles maps each column to its (steps, levels) quantile values; a
+    point forecast without them has a band of zero width. bands maps each
+    column to per-step (point, lower, upper) tuples of the BAND interval,
+    and stats to the summary served by the forecast distribution graph.
+    All of it is computed once here instead of on every reading or request.
+    """
+
+    __slots__ = ("preds_df", "created", "started", "step_seconds", "horizon", "mean", "min", "max",
+                 "levels", "quantiles", "bands", "stats")
+
+    def __init__(self, preds_df, quantiles=None, levels=None):
+        self.preds_df = preds_df
+        self.created = datetime.now()
+        self.started = self.created.timestamp()
+        times = preds_df.select_dtypes("datetime")
+        self.step_seconds = 3600.0
+        if len(times.columns) and len(times) > 1:
+            self.step_seconds = (times.iloc[1, 0] - times.iloc[0, 0]).total_seconds()
+        values = preds_df.select_dtypes("number")
+        self.horizon = {column: values[column].to_numpy() for column in values.columns}
+        self.mean = {column: float(v.mean()) for column, v in self.horizon.items()}
+        self.min = {column: float(v.min()) for column, v in self.horizon.items()}
+        self.max = {column: float(v.max()) for column, v in self.horizon.items()}
+        self.levels = list(levels) if quantiles is not None else [0.5]
+        self.quantiles = quantiles if quantiles is not None else {
+            column: v[:, None] for column, v in self.horizon.items()
+        }
+        lower, upper = (nearest_level(self.levels, level) for level in BAND)
+        self.bands = {}
+        self.stats = {}
+        for column, point in self.horizon.items():
+            q = self.quantiles[column]
+            self.bands[column] = list(zip(point.tolist(), q[:, lower].tolist(), q[:, upper].tolist()))
+            self.stats[column] = {
+                "mean": self.mean[column], "median": float(np.median(point)), "std": float(np.std(point)),
+                "min": self.min[column], "max": self.max[column],
+                # Envelope of the interval band over the horizon
+                f"p{round(BAND[0] * 100)}": float(q[:, lower].min()),
+                f"p{round(BAND[1] * 100)}": float(q[:, upper].max()),
+            }
+
+    def band_at(self, column, now=None):
+        """(point, lower, upper) of a column at the step the time since the forecast was made falls in.
+
+        Past the horizon, the last step's band is used.
+        """
+        band = self.bands[column]
+        step = int(((now or time.time()) - self.started) // self.step_seconds)
+        return band[min(max(step, 0), len(band) - 1)]
+
+
+class ForecastCache:
+    """LRU cache of forecasts with a time-to-live.
+
+    Keys are (subject id, horizon, digest of the scaled input window), so a
+    subject whose window has not changed reuses its forecast until it
+    expires.
+    """
+
+    def __init__(self, max_entries=10000, ttl=900):
+        self.max_entries = max_entries
+        self.ttl = ttl  # Seconds a forecast stays valid
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expiry, Forecast), least recently used first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, forecast):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, forecast)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def window_digest(series, end_time):
+    """Hash of a scaled input window's values and the time it ends at"""
+    digest = hashlib.blake2b(np.ascontiguousarray(series.values()).tobytes(), digest_size=16)
+    digest.update(str(end_time).encode())
+    return digest.hexdigest()
+
+
+def quantile_forecasts(model, series, n, batch_size=32):
+    """Scaled per-step quantiles, (len(series), n, components, levels), and their levels.
+
+    A tft_inference.LeanForecaster outputs them directly. A darts TFTModel
+    is asked for its quantile outputs one output chunk at a time, rolling
+    each series forward on the median between chunks as LeanForecaster
+    does (its point predict instead samples one quantile at random).
+    """
+    if hasattr(model, "predict_quantiles"):
+        windows = np.stack([s.values(copy=False)[-model.input_chunk_length:] for s in series])
+        return model.predict_quantiles(windows, n, batch_size), model.quantiles
+    
+    levels = model.likelihood.quantiles
+    median = levels.index(0.5)
+    chunks = []
+    steps = 0
+    while steps < n:
+        preds = model.predict(n=model.output_chunk_length, series=series, predict_likelihood_parameters=True,
+                              batch_size=batch_size, verbose=False)
+        # Components are named "<column>_q<level>", each column's levels together
+        chunk = np.stack([pred.values(copy=False) for pred in preds])
+        chunk = chunk.reshape(len(series), model.output_chunk_length, -1, len(levels))
+        chunks.append(chunk)
+        steps += chunk.shape[1]
+        if steps < n:
+            series = [s.append_values(values[:, :, median]) for s, values in zip(series, chunk)]
+    return np.concatenate(chunks, axis=1)[:, :n], list(levels)
+
+
+def quantile_forecast(scaler, series, values, levels):
+    """Forecast from scaled (steps, components, levels) quantiles of the steps after series"""
+    times = pd.date_range(series.end_time() + series.freq, periods=len(values), freq=series.freq,
+                          name=series.time_index.name)
+    # The levels ride on the sample axis, so one inverse_transform unscales all of them
+    values = np.asarray(values, dtype=series.dtype)
+    pred = scaler.inverse_transform(TimeSeries.from_times_and_values(times, values, columns=series.components))
+    # The network does not constrain its quantile outputs to be monotone, so
+    # sort them along the level axis (levels are ascending) to keep the bands
+    # from crossing (lower > upper)
+    quantiles = np.sort(pred.all_values(copy=False), axis=-1)
+    columns = list(pred.components)
+    preds_df = pd.DataFrame(quantiles[:, :, levels.index(0.5)], index=pred.time_index, columns=columns)
+    return Forecast(preds_df.reset_index(), {column: quantiles[:, i, :] for i, column in enumerate(columns)},
+                    levels)
+
+
+def predict_batch(model, windows, scalers, horizon=24, batch_size=32, cache=None):
+    """Forecast many subjects with one batched model call per output chunk.
+
+    windows maps subject id -> unscaled input DataFrame. scalers is either one
+    fitted Scaler shared by every series or a dict of per-subject fitted
+    Scalers. batch_size is the number of series per inference batch. With a
+    ForecastCache, only windows without a live cached forecast are sent to
+    the model. Returns subject id -> Forecast, with per-step quantiles.
+    """
+    def scaler_for(subject_id):
+        return scalers[subject_id] if isinstance(scalers, dict) else scalers
+    
+    forecasts = {}
+    pending = {}  # subject id -> (cache key, scaled series)
+    for subject_id, window in windows.items():
+        series = scaler_for(subject_id).transform(TimeSeries.from_dataframe(window, value_cols=window.columns))
+        key = None
+        if cache is not None:
+            key = (subject_id, horizon, window_digest(series, window.index[-1]))
+            cached = cache.get(key)
+            if cached is not None:
+                forecasts[subject_id] = cached
+                continue
+        pending[subject_id] = (key, series)
+    
+    if pending:
+        values, levels = quantile_forecasts(model, [series for _, series in pending.values()], horizon,
+                                            batch_size)
+        for (subject_id, (key, series)), quantiles in zip(pending.items(), values):
+            forecast = quantile_forecast(scaler_for(subject_id), series, quantiles, levels)
+            if cache is not None:
+                cache.put(key, forecast)
+            forecasts[subject_id] = forecast
+    return forecasts
+
+
+class ForecastService:
+    """Background worker that keeps a fresh forecast per subject.
+
+    Every `interval` seconds it snapshots the subjects with live data, builds
+    an hourly input window for each and predicts `horizon` steps ahead for
+    all of them in one batched call. The forecasts dict is rebuilt and
+    replaced in one assignment, so readers never see a half-updated map and
+    evicted subjects drop out of it. The snapshot does not touch the
+    subjects' LRU order or idle timers, so the service never keeps an idle
+    subject from being evicted.
+    """
+
+    def __init__(self, model, scaler, template, subjects, interval=60, horizon=24, batch_size=32,
+                 cache=None, history=None):
+        self.model = model
+        self.scaler = scaler
+        self.template = template  # Cleaned hourly dataset (unscaled)
+        self.subjects = subjects
+        self.history = history  # HistoryStore the subjects' windows are read from, if any
+        self.interval = interval
+        self.horizon = horizon
+        self.batch_size = batch_size
+        self.cache = cache if cache is not None else ForecastCache()
+        self.forecasts = {}  # subject id -> Forecast
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def input_length(self):
+        return getattr(self.model, "input_chunk_length", 24)
+
+    def get(self, subject_id):
+        """Latest forecast for a subject, or None if there is none yet"""
+        return self.forecasts.get(subject_id)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="forecast-service", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"❌ Forecast refresh failed: {e}")
+            self._stop.wait(self.interval)
+
+    def run_once(self):
+        """Re-forecast every subject that has live data"""
+        if self.model is None:
+            return  # Still loading
+        windows = {}
+        for state in self.subjects.states():
+            if len(state.history) == 0:
+                continue
+            windows[state.subject_id] = self.build_window(state)
+        
+        # Atomic swap
+        self.forecasts = predict_batch(self.model, windows, self.scaler, self.horizon, self.batch_size,
+                                       cache=self.cache)
+
+    def hourly_vitals(self, state, start):
+        """Hourly means of a subject's filtered live vitals since start, indexed by hour.
+
+        Read from the history store when the service has one, else from the
+        subject's in-memory history (its last 100 assessments).
+        """
+        if self.history is not None:
+            rows = self.history.hourly_means(state.subject_id, [vital_key.lower() for vital_key in LIVE_COLUMNS],
+                                             to_timestamp_us(start))
+            hours = pd.to_datetime([hour for hour, _ in rows], unit="us")
+            return pd.DataFrame([row for _, row in rows], index=hours, columns=list(LIVE_COLUMNS), dtype=float)
+        # One copy of the history, so concurrent appends cannot tear the read
+        timestamps, columns = state.history.snapshot()
+        live = np.array([columns[vital_key] for vital_key in LIVE_COLUMNS]).T
+        recent = timestamps >= to_timestamp_us(start)
+        hours = pd.to_datetime(timestamps[recent], unit="us").floor("h")
+        return pd.DataFrame(live[recent], index=hours, columns=list(LIVE_COLUMNS)).groupby(level=0).mean()
+
+    def build_window(self, state):
+        """Hourly input window ending at the current hour, from the subject's own history.
+
+        Each live column holds the hourly means of the subject's filtered
+        vitals; hours without readings repeat the last hour that had some.
+        Hours before the subject's first reading in the window, and the
+        covariates the sensors do not measure, have no subject data: those
+        are deliberately approximated by the training history's last hours,
+        relabelled to the window.
+        """
+        window = self.template.iloc[-self.input_length:].copy()
+        end = pd.Timestamp(datetime.now()).floor("h")
+        window.index = pd.date_range(end=end, periods=len(window), freq="h", name=window.index.name)
+        live = self.hourly_vitals(state, window.index[0].to_pydatetime()).reindex(window.index).ffill()
+        for vital_key, column in LIVE_COLUMNS.items():
+            if column in window.columns:
+                window[column] = live[vital_key].fillna(window[column])
+        return window
@@ -0,0 +1,186 @@
+"""Append-only on-disk history of every subject's assessments.
+
+The in-memory ring buffers only hold each subject's last 100 assessments.
+HistoryStore keeps all of them, for incident review, in an SQLite database
+in WAL mode. Rows are queued by the ingest workers and written by a single
+writer thread in batched transactions, so ingestion never waits on the
+disk. Readers use their own connections, which WAL lets run alongside the
+writer. Range queries stream rows from a cursor, so reading days of history
+does not load it into memory. Rows older than `retention` are pruned.
+
+Each row holds the subject, the timestamp (int64 µs, as in the ring
+buffers) and the history columns: V0-V4, risk, status code, rolling mean
+and volatility.
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from ring_buffer import to_timestamp_us
+
+HISTORY_COLUMNS = ["v0", "v1", "v2", "v3", "v4", "risk", "status", "rolling_mean", "volatility"]
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS subjects (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL);
+CREATE TABLE IF NOT EXISTS history (
+    subject INTEGER NOT NULL, ts INTEGER NOT NULL, {", ".join(f"{column} REAL" for column in HISTORY_COLUMNS)}
+);
+CREATE INDEX IF NOT EXISTS history_subject_ts ON history (subject, ts);
+"""
+
+
+class HistoryStore:
+    """SQLite WAL table of assessment rows with a batching writer thread"""
+
+    def __init__(self, path, batch_size=1000, flush_interval=0.5, max_pending=100000,
+                 retention=7 * 24 * 3600):
+        self.path = path
+        self.batch_size = batch_size  # Rows per write transaction at most
+        self.flush_interval = flush_interval  # Seconds a row can wait for its batch to fill
+        self.retention = retention  # Seconds of history kept (None keeps everything)
+        self.dropped = 0  # Rows lost because the write queue was full
+        self.written = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._local = threading.local()  # One reader connection per thread
+        self._subject_ids = {}  # Subject name -> id, used by the writer
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def connect(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")  # Durable at checkpoints; fine for monitoring history
+        conn.executescript(SCHEMA)
+        return conn
+
+    def reader(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self.connect()
+        return conn
+
+    # ✅ Writing
+    def record(self, state, assessment=None, previous=None):
+        """Queue a subject's newest history row (a risk_engine assessment listener)"""
+        timestamps, values = state.history.window(1)
+        self.append(state.subject_id, int(timestamps[0]), values[:, 0].tolist())
+
+    def append(self, subject_id, timestamp_us, row):
+        """Queue one row; the writer thread is started on first use"""
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait((subject_id, timestamp_us, row))
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+                self._thread.start()
+
+    def flush(self):
+        """Block until every queued row is written"""
+        self._queue.join()
+
+    def _run(self):
+        conn = self.connect()
+        last_prune = 0.0
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                self._write(conn, batch)
+                if self.retention is not None and time.monotonic() - last_prune > 60:
+                    self.prune(conn)
+                    last_prune = time.monotonic()
+            except sqlite3.Error as e:
+                print(f"❌ Writing {len(batch)} history rows failed: {e}")
+            for _ in batch:
+                self._queue.task_done()
+
+    def _write(self, conn, batch):
+        with conn:  # One transaction per batch
+            rows = [(self._subject_id(conn, subject_id), timestamp_us, *row)
+                    for subject_id, timestamp_us, row in batch]
+            conn.executemany(
+                f"INSERT INTO history VALUES ({', '.join('?' * (len(HISTORY_COLUMNS) + 2))})", rows
+            )
+        self.written += len(batch)
+
+    def _subject_id(self, conn, subject_id):
+        key = self._subject_ids.get(subject_id)
+        if key is None:
+            conn.execute("INSERT OR IGNORE INTO subjects (name) VALUES (?)", (subject_id,))
+            key = conn.execute("SELECT id FROM subjects WHERE name = ?", (subject_id,)).fetchone()[0]
+            self._subject_ids[subject_id] = key
+        return key
+
+    def prune(self, conn):
+        cutoff_us = to_timestamp_us(datetime.now() - timedelta(seconds=self.retention))
+        with conn:
+            conn.execute("DELETE FROM history WHERE ts < ?", (cutoff_us,))
+
+    # ✅ Reading
+    def query(self, subject_id, start_us=None, end_us=None, after=None, fetch_size=500):
+        """Stream (cursor, timestamp_us, row) of a subject in time order.
+
+        start_us / end_us bound the timestamps (inclusive / exclusive).
+        after is the cursor of the last row of the previous page. Rows are
+        fetched fetch_size at a time, so any range can be read in constant
+        memory.
+        """
+        sql = ("SELECT history.rowid, ts, " + ", ".join(HISTORY_COLUMNS) +
+               " FROM history JOIN subjects ON subjects.id = history.subject WHERE subjects.name = ?")
+        params = [subject_id]
+        if start_us is not None:
+            sql += " AND ts >= ?"
+            params.append(start_us)
+        if end_us is not None:
+            sql += " AND ts < ?"
+            params.append(end_us)
+        if after is not None:
+            sql += " AND (ts, history.rowid) > (?, ?)"
+            params += [after[0], after[1]]
+        cursor = self.reader().execute(sql + " ORDER BY ts, history.rowid", params)
+        try:
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    return
+                for rowid, timestamp_us, *row in rows:
+                    yield (timestamp_us, rowid), timestamp_us, row
+        finally:
+            cursor.close()
+
+    def latest(self, subject_id, limit=100):
+        """The subject's last `limit` rows as (cursor, timestamp_us, row), oldest first"""
+        rows = self.reader().execute(
+            "SELECT history.rowid, ts, " + ", ".join(HISTORY_COLUMNS) +
+            " FROM history JOIN subjects ON subjects.id = history.subject WHERE subjects.name = ?"
+            " ORDER BY ts DESC, history.rowid DESC LIMIT ?", (subject_id, limit)
+        ).fetchall()
+        return [((timestamp_us, rowid), timestamp_us, row) for rowid, timestamp_us, *row in reversed(rows)]
+
+    def hourly_means(self, subject_id, columns, start_us=None):
+        """(hour start µs, [mean of each column]) of each hour with rows, oldest first"""
+        if not set(columns) <= set(HISTORY_COLUMNS):
+            raise ValueError(f"Unknown history columns: {columns}")
+        sql = ("SELECT ts / 3600000000 AS hour, " + ", ".join(f"AVG({column})" for column in columns) +
+               " FROM history JOIN subjects ON subjects.id = history.subject WHERE subjects.name = ?")
+        params = [subject_id]
+        if start_us is not None:
+            sql += " AND ts >= ?"
+            params.append(start_us)
+        rows = self.reader().execute(sql + " GROUP BY hour ORDER BY hour", params).fetchall()
+        return [(hour * 3600000000, row) for hour, *row in rows]
@@ -0,0 +1,153 @@
+"""Queue-based ingestion: endpoints enqueue readings, shard workers process them.
+
+Readings are routed to one of n_shards bounded queues by a hash of their
+subject id, so all of a subject's readings are processed in order by one
+worker thread and no two workers ever touch the same subject. Each worker
+drains whatever is queued (up to batch_size readings) and filters and
+scores it with one vectorized risk_engine.ingest_batch call; if that fails,
+the readings are retried one at a time so only bad ones are dropped. Readings
+are validated by the endpoints before they are queued. Binary frames are
+queued as blocks (risk_engine.ReadingBlock), one item per shard per request.
+When a shard already holds max_queue readings, new ones are dropped and
+counted instead of blocking the request thread.
+"""
+import queue
+import threading
+import zlib
+
+import numpy as np
+
+import risk_engine
+
+
+def readings(item):
+    """Number of readings in a queued item: a triple or a ReadingBlock"""
+    return len(item) if isinstance(item, risk_engine.ReadingBlock) else 1
+
+
+class IngestPipeline:
+    """Sharded worker pool draining bounded reading queues in micro-batches"""
+
+    def __init__(self, n_shards=4, max_queue=10000, batch_size=256):
+        self.n_shards = n_shards
+        self.max_queue = max_queue  # Readings a shard can hold
+        self.batch_size = batch_size
+        self.queues = [queue.Queue() for _ in range(n_shards)]
+        # Counters; written under _stats_lock, read without it
+        self.depths = [0] * n_shards  # Readings queued or being processed, per shard
+        self.accepted = 0
+        self.dropped = 0
+        self.processed = 0
+        self.batches = 0
+        self.errors = 0
+        self._stats_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def shard(self, subject_id):
+        return zlib.crc32(subject_id.encode()) % self.n_shards
+
+    def submit(self, subject_id, timestamp, reading):
+        """Enqueue a reading; returns False (and counts a drop) if its shard is full"""
+        return self._put(self.shard(subject_id), (subject_id, timestamp, reading), 1)
+
+    def submit_block(self, block):
+        """Enqueue a risk_engine.ReadingBlock as one item per shard; returns the number of readings dropped"""
+        shards = {subject_id: self.shard(subject_id) for subject_id in set(block.subject_ids)}
+        rows = np.array([shards[subject_id] for subject_id in block.subject_ids])
+        dropped = 0
+        for shard in set(shards.values()):
+            part = block.take(np.flatnonzero(rows == shard)) if len(shards) > 1 else block
+            dropped += 0 if self._put(shard, part, len(part)) else len(part)
+        return dropped
+
+    def _put(self, shard, item, size):
+        with self._stats_lock:
+            if self.depths[shard] + size > self.max_queue:
+                self.dropped += size
+                return False
+            self.depths[shard] += size
+            self.accepted += size
+        self.queues[shard].put_nowait(item)
+        return True
+
+    def start(self):
+        if any(thread.is_alive() for thread in self._threads):
+            return
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._run, args=(shard,), name=f"ingest-{shard}", daemon=True)
+            for shard in range(self.n_shards)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Stop the workers once they have processed everything already queued"""
+        self.flush()
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+
+    def flush(self):
+        """Block until every reading queued so far has been processed"""
+        for shard_queue in self.queues:
+            shard_queue.join()
+
+    def _run(self, shard):
+        shard_queue = self.queues[shard]
+        while not self._stop.is_set():
+            try:
+                batch = [shard_queue.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+            # Take whatever else is already waiting, without waiting for more
+            size = readings(batch[0])
+            while size < self.batch_size:
+                try:
+                    batch.append(shard_queue.get_nowait())
+                except queue.Empty:
+                    break
+                size += readings(batch[-1])
+
+            failed = self._ingest(batch)
+            with self._stats_lock:
+                self.processed += size - failed
+                self.errors += failed
+                self.batches += 1
+                self.depths[shard] -= size
+            for _ in batch:
+                shard_queue.task_done()
+
+    def _ingest(self, batch):
+        """Ingest a micro-batch; returns the number of readings that failed.
+
+        If the batch fails as a whole, its readings are retried one at a
+        time, so only the bad ones are dropped.
+        """
+        try:
+            risk_engine.ingest_batch(batch)
+            return 0
+        except Exception as e:
+            if len(batch) == 1 and readings(batch[0]) == 1:
+                print(f"❌ Dropped a reading for {batch[0][0]}: {e}")
+                return 1
+            print(f"❌ Ingesting {sum(map(readings, batch))} readings failed ({e}), retrying one at a time")
+        failed = 0
+        for item in risk_engine.expand_readings(batch):
+            try:
+                risk_engine.ingest_batch([item])
+            except Exception as e:
+                print(f"❌ Dropped a reading for {item[0]}: {e}")
+                failed += 1
+        return failed
+
+    def stats(self):
+        return {
+            "accepted": self.accepted,
+            "dropped": self.dropped,
+            "processed": self.processed,
+            "errors": self.errors,
+            "batches": self.batches,
+            "queue_depths": list(self.depths)
+        }
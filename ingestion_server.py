@@ -0,0 +1,330 @@
+"""Slim ingestion-only server profile.
+
+Serves the ingestion and risk endpoints using only Flask, NumPy and the
+filter/risk code, without loading torch, darts, pandas or matplotlib. Risk
+scores skip the forecast deviation term, because this profile has no
+forecasts. The full server (Tft_Forecast.py) registers the same blueprint
+next to its forecasting and graph endpoints.
+
+Posted readings are only validated and queued here; the ingest pipeline's
+workers filter and score them off the request thread. Gateways can also
+send packed binary frames (see binary_ingest.py), to /blynk_data/binary or
+to the UDP/TCP frame listener.
+
+    python ingestion_server.py
+
+Assessments are also stored on disk (see history_store.py), in
+history/history.sqlite3 next to this file unless HEATSTROKE_HISTORY_PATH
+is set.
+"""
+import math
+import os
+import time
+from itertools import islice
+
+from flask import Blueprint, Flask, Response, jsonify, request
+
+import binary_ingest
+import metrics
+import risk_engine
+from assessment_stream import EVENT_KINDS, AssessmentBroadcaster
+from binary_ingest import FrameListener
+from history_store import HistoryStore
+from ingest_pipeline import IngestPipeline
+from risk_engine import subjects
+from ring_buffer import to_timestamp_us
+from subjects import DEFAULT_SUBJECT
+
+ingestion = Blueprint("ingestion", __name__)
+
+# ✅ Ingest Queue (workers started by the server's __main__)
+pipeline = IngestPipeline(n_shards=4, max_queue=10000, batch_size=256)
+
+# ✅ Binary Frames over UDP and TCP (started by the server's __main__)
+frame_listener = FrameListener(pipeline, port=5002)
+
+# ✅ Assessment Stream (every recorded assessment is pushed to /stream clients)
+broadcaster = AssessmentBroadcaster(max_pending=1000, keepalive=15)
+risk_engine.assessment_listeners.append(broadcaster.publish)
+
+# ✅ History Store (every assessment is also appended to disk, kept 7 days)
+# The database is history/history.sqlite3 next to this file, or $HEATSTROKE_HISTORY_PATH
+HISTORY_PATH = os.environ.get("HEATSTROKE_HISTORY_PATH",
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), "history", "history.sqlite3"))
+history_store = HistoryStore(HISTORY_PATH, retention=7 * 24 * 3600)
+risk_engine.assessment_listeners.append(history_store.record)
+MAX_HISTORY_PAGE = 10000
+
+# ✅ Metrics
+REQUEST_STAGE_SECONDS = metrics.Histogram(
+    "heatstroke_request_stage_seconds", "Time spent in each stage of a request", ("endpoint", "stage")
+)
+profiler = metrics.SamplingProfiler()  # Toggled through /profiler/start and /profiler/stop
+MAX_SUBJECT_SERIES = 1000  # Per-subject series exported, most recently seen first
+
+
+def collect_ingestion_metrics():
+    stats = pipeline.stats()
+    states = subjects.states()
+    history_sizes = [len(state.history) for state in states]
+    recent = states[-MAX_SUBJECT_SERIES:]
+    return [
+        ("heatstroke_ingest_readings_total", "counter", "Readings by ingest outcome",
+         [({"outcome": outcome}, stats[outcome]) for outcome in ("accepted", "dropped", "processed", "errors")]),
+        ("heatstroke_ingest_batches_total", "counter", "Micro-batches processed by the ingest workers",
+         [({}, stats["batches"])]),
+        ("heatstroke_ingest_queue_depth", "gauge", "Readings queued or being processed in each ingest shard",
+         [({"shard": str(shard)}, depth) for shard, depth in enumerate(stats["queue_depths"])]),
+        ("heatstroke_subjects", "gauge", "Subjects currently tracked", [({}, len(states))]),
+        ("heatstroke_history_length", "gauge", "Total and largest per-subject history length",
+         [({"stat": "total"}, sum(history_sizes)), ({"stat": "max"}, max(history_sizes, default=0))]),
+        ("heatstroke_subject_readings_total", "counter", "Assessments recorded per subject",
+         [({"subject_id": state.subject_id}, state.readings) for state in recent]),
+        ("heatstroke_stream_subscribers", "gauge", "Connected /stream clients",
+         [({}, broadcaster.stats()["subscribers"])]),
+        ("heatstroke_stream_dropped_total", "counter", "Stream frames dropped for slow clients",
+         [({}, broadcaster.dropped)]),
+        ("heatstroke_history_rows_total", "counter", "Assessment rows by history store outcome",
+         [({"outcome": "written"}, history_store.written), ({"outcome": "dropped"}, history_store.dropped)]),
+    ]
+
+
+metrics.register_collector(collect_ingestion_metrics)
+
+
+def lookup_subject():
+    """Resolve the ?subject_id= of a read request to its state (None if unknown)"""
+    subject_id = request.args.get("subject_id", DEFAULT_SUBJECT)
+    # Lock-free lookup, so reads never wait on the ingest workers
+    state = subjects.peek(subject_id)
+    if state is None and subject_id == DEFAULT_SUBJECT:
+        # The default subject always exists so the dashboard works before any data
+        state = subjects.get(subject_id)
+    return state
+
+
+def unknown_subject():
+    return jsonify({"status": "error", "message": "Unknown subject"}), 404
+
+
+def parse_reading(reading):
+    """Validate a posted reading and split it into (subject id, timestamp, vitals).
+
+    Vitals are normalised to floats here, before the reading is queued, so a
+    bad reading is rejected with its request instead of failing a worker's batch.
+    """
+    reading = dict(reading)
+    # The subject can be given in the body or as ?subject_id=; null or empty
+    # means the default subject, as in binary frames
+    subject_id = reading.pop("subject_id", None)
+    if subject_id is None or subject_id == "":
+        subject_id = request.args.get("subject_id") or DEFAULT_SUBJECT
+    subject_id = str(subject_id)
+    timestamp = risk_engine.parse_timestamp(reading.pop("timestamp", None))
+    for vital_key in risk_engine.FRAME_KEYS:
+        value = reading.get(vital_key)
+        if value is None:
+            reading.pop(vital_key, None)
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            raise ValueError(f"{vital_key} must be a finite number")
+        reading[vital_key] = float(value)
+    return subject_id, timestamp, reading
+
+
+def queue_full(accepted, dropped):
+    """Backpressure response: the client should retry the dropped readings later"""
+    response = jsonify({"status": "error", "message": "Ingest queue full",
+                        "accepted": accepted, "dropped": dropped})
+    return response, 503, {"Retry-After": "1"}
+
+
+# ✅ Flask Endpoints
+@ingestion.route("/risk_assessment", methods=["GET"])
+def get_risk_assessment():
+    state = lookup_subject()
+    if state is None:
+        return unknown_subject()
+    # Return the most recent risk assessment
+    return jsonify(state.last_risk_assessment)
+
+
+def time_arg(name):
+    """Optional ?name= (epoch seconds or ISO 8601) as int64 µs; raises ValueError if malformed"""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        value = float(value)
+    except ValueError:
+        pass
+    return to_timestamp_us(risk_engine.parse_timestamp(value))
+
+
+@ingestion.route("/risk_history", methods=["GET"])
+def get_risk_history():
+    # Pages of the on-disk history, oldest first. Without start, end or
+    # cursor, returns the latest `limit` assessments. When more rows match,
+    # the X-Next-Cursor header holds the cursor of the next page.
+    subject_id = request.args.get("subject_id", DEFAULT_SUBJECT)
+    try:
+        start, end = time_arg("start"), time_arg("end")
+        limit = min(int(request.args.get("limit", 100)), MAX_HISTORY_PAGE)
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        cursor = request.args.get("cursor")
+        after = tuple(int(part) for part in cursor.split(":")) if cursor else None
+        if after is not None and len(after) != 2:
+            raise ValueError("cursor must be <timestamp>:<row id>, as in X-Next-Cursor")
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    headers = {}
+    if start is None and end is None and after is None:
+        page = history_store.latest(subject_id, limit)
+    else:
+        page = list(islice(history_store.query(subject_id, start, end, after), limit + 1))
+        if len(page) > limit:
+            page = page[:limit]
+            headers["X-Next-Cursor"] = "%d:%d" % page[-1][0]
+    if not page and subject_id not in subjects and subject_id != DEFAULT_SUBJECT:
+        return unknown_subject()
+    records = risk_engine.assessment_records([timestamp for _, timestamp, _ in page], [row for _, _, row in page])
+    return jsonify(records), 200, headers
+
+
+@ingestion.route("/subjects", methods=["GET"])
+def get_subjects():
+    # Subjects currently tracked, least recently seen first
+    return jsonify(subjects.subject_ids())
+
+
+@ingestion.route("/ingest_stats", methods=["GET"])
+def get_ingest_stats():
+    # Accepted / dropped / processed counters and per-shard queue depths
+    return jsonify({**pipeline.stats(), "stream": broadcaster.stats()})
+
+
+@ingestion.route("/metrics", methods=["GET"])
+def get_metrics():
+    # Prometheus text exposition format
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@ingestion.route("/profiler/start", methods=["POST"])
+def start_profiler():
+    # ?interval= seconds between samples, clamped to at least 1 ms
+    try:
+        interval = float(request.args.get("interval", 0.005))
+        if not math.isfinite(interval):
+            raise ValueError(f"interval must be a finite number of seconds, got {interval}")
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    profiler.start(interval)
+    return jsonify({"status": "running", "interval": profiler.interval})
+
+
+@ingestion.route("/profiler/stop", methods=["POST"])
+def stop_profiler():
+    # Collapsed stacks ("frame;frame;frame count"), ready for a flame graph
+    profiler.stop()
+    return Response(profiler.collapsed(), mimetype="text/plain")
+
+
+@ingestion.route("/stream", methods=["GET"])
+def stream_assessments():
+    # Server-Sent Events: ?subject_id= follows one subject (default: all),
+    # ?events=delta sends only what changed since the subject's last assessment
+    kind = request.args.get("events", "assessment")
+    if kind not in EVENT_KINDS:
+        return jsonify({"status": "error", "message": f"Unknown events: {kind}"}), 400
+    events = broadcaster.events(request.args.get("subject_id"), kind)
+    return Response(events, mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@ingestion.route("/blynk_data", methods=["POST"])
+def receive_blynk_data():
+    start = time.perf_counter()
+    try:
+        subject_id, timestamp, reading = parse_reading(request.json)
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    parsed = time.perf_counter()
+
+    # Filtering and scoring happen on the subject's ingest worker; the result
+    # shows up in /risk_assessment
+    queued = pipeline.submit(subject_id, timestamp, reading)
+    REQUEST_STAGE_SECONDS.observe(parsed - start, "/blynk_data", "parse")
+    REQUEST_STAGE_SECONDS.observe(time.perf_counter() - parsed, "/blynk_data", "enqueue")
+    if not queued:
+        return queue_full(0, 1)
+    return jsonify({"status": "queued", "subject_id": subject_id}), 202
+
+
+# Batch endpoint for buffered readings, e.g. flushed by a device after a gap
+@ingestion.route("/blynk_data/batch", methods=["POST"])
+def receive_blynk_batch():
+    try:
+        # Accept {"readings": [...]} or a bare list of readings
+        payload = request.json
+        readings = payload["readings"] if isinstance(payload, dict) else payload
+        parsed = [parse_reading(reading) for reading in readings]
+        # Queue in timestamp order (stable, so untimed readings keep their order)
+        parsed.sort(key=lambda item: item[1])
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    dropped = sum(not pipeline.submit(*item) for item in parsed)
+    if dropped:
+        return queue_full(len(parsed) - dropped, dropped)
+    return jsonify({"status": "queued", "count": len(parsed)}), 202
+
+
+# Packed binary frames (or MessagePack) from gateways, see binary_ingest.py
+@ingestion.route("/blynk_data/binary", methods=["POST"])
+def receive_binary_frames():
+    start = time.perf_counter()
+    try:
+        if request.mimetype == "application/msgpack":
+            readings = binary_ingest.decode_msgpack(request.get_data())
+        else:
+            readings = binary_ingest.decode_frames(request.get_data())
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    parsed = time.perf_counter()
+
+    accepted, dropped = binary_ingest.queue_readings(pipeline, *readings)
+    binary_ingest.count("http", accepted, dropped)
+    REQUEST_STAGE_SECONDS.observe(parsed - start, "/blynk_data/binary", "parse")
+    REQUEST_STAGE_SECONDS.observe(time.perf_counter() - parsed, "/blynk_data/binary", "enqueue")
+    if dropped:
+        return queue_full(accepted, dropped)
+    return jsonify({"status": "queued", "count": accepted}), 202
+
+
+# Add endpoint to get the raw vs filtered data for visualization
+@ingestion.route("/filter_data", methods=["GET"])
+def get_filter_data():
+    state = lookup_subject()
+    if state is None:
+        return unknown_subject()
+    n_vitals = len(risk_engine.VITAL_KEYS)
+    return jsonify({
+        "raw_values": state.raw.window()[1].tolist(),
+        "filtered_values": state.history.window()[1][:n_vitals].tolist()
+    })
+
+
+# ✅ Initialize Flask App
+app = Flask(__name__)
+app.register_blueprint(ingestion)
+
+if __name__ == "__main__":
+    # Initialize the Kalman filters and start the ingest workers
+    risk_engine.setup_kalman_filters()
+    pipeline.start()
+    frame_listener.start()
+
+    # Run the Flask app
+    app.run(debug=True, host="0.0.0.0", port=5001, use_reloader=False)
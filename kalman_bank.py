@@ -0,0 +1,104 @@
+"""Vectorized bank of constant-velocity Kalman filters.
+
+Every (subject, vital) pair is a 1-D position/velocity filter with the same
+F = [[1, 1], [0, 1]] and H = [1, 0] used by the original filterpy setup, so
+all of them can be advanced together with plain NumPy array arithmetic.
+"""
+import numpy as np
+
+
+class KalmanFilterBank:
+    """Kalman filters for n_subjects x n_vitals, stepped in one vectorized pass.
+
+    State is kept as x (subjects, vitals, 2) and P (subjects, vitals, 2, 2).
+    Q and R are per vital and shared by all subjects. The update uses the same
+    Joseph-form covariance update as filterpy, so results match it to
+    floating-point precision.
+    """
+
+    def __init__(self, Q, R, n_subjects=1, initial_uncertainty=1.0):
+        self.Q = np.array(Q, dtype=float).reshape(-1, 2, 2)  # (vitals, 2, 2)
+        self.R = np.array(R, dtype=float).reshape(-1)  # (vitals,)
+        self.n_vitals = len(self.R)
+        self.initial_uncertainty = initial_uncertainty
+        self.x = np.zeros((0, self.n_vitals, 2))
+        self.P = np.zeros((0, self.n_vitals, 2, 2))
+        self.resize(n_subjects)
+
+    @property
+    def n_subjects(self):
+        return self.x.shape[0]
+
+    def resize(self, n_subjects):
+        """Grow or shrink the bank, initialising any new subjects"""
+        old = self.n_subjects
+        if n_subjects < old:
+            self.x = self.x[:n_subjects].copy()
+            self.P = self.P[:n_subjects].copy()
+            return
+        self.x = np.concatenate([self.x, np.zeros((n_subjects - old, self.n_vitals, 2))])
+        self.P = np.concatenate([self.P, np.zeros((n_subjects - old, self.n_vitals, 2, 2))])
+        self.reset(np.arange(old, n_subjects))
+
+    def reset(self, subjects=None):
+        """Reset filters to position 0, velocity 0 and a large uncertainty"""
+        if subjects is None:
+            subjects = slice(None)
+        self.x[subjects] = 0.
+        self.P[subjects] = np.eye(2) * self.initial_uncertainty
+
+    def step(self, z, subjects=None):
+        """Predict and update with measurements z, returning filtered positions.
+
+        z has shape (subjects, vitals), or (vitals,) for a single subject. NaN
+        entries are treated as missing: those filters are only predicted. If
+        subjects (an index array) is given, only those rows of the bank are
+        advanced and z must have one row per index.
+        """
+        z = np.asarray(z, dtype=float)
+        if z.ndim == 1:
+            z = z[np.newaxis, :]
+        rows = slice(None) if subjects is None else subjects
+        x = self.x[rows]
+        P = self.P[rows]
+
+        # Predict: x = F x, P = F P F^T + Q
+        x0 = x[..., 0] + x[..., 1]
+        x1 = x[..., 1]
+        fp00 = P[..., 0, 0] + P[..., 1, 0]
+        fp01 = P[..., 0, 1] + P[..., 1, 1]
+        fp10 = P[..., 1, 0]
+        fp11 = P[..., 1, 1]
+        p00 = fp00 + fp01 + self.Q[:, 0, 0]
+        p01 = fp01 + self.Q[:, 0, 1]
+        p10 = fp10 + fp11 + self.Q[:, 1, 0]
+        p11 = fp11 + self.Q[:, 1, 1]
+
+        # Update: K = P H^T / (H P H^T + R), Joseph-form covariance update
+        observed = ~np.isnan(z)
+        R = self.R
+        S = p00 + R
+        k0 = p00 / S
+        k1 = p10 / S
+        y = np.where(observed, z - x0, 0.)
+        a00 = (1. - k0) * p00
+        a01 = (1. - k0) * p01
+        a10 = p10 - k1 * p00
+        a11 = p11 - k1 * p01
+        u00 = a00 * (1. - k0) + R * k0 * k0
+        u01 = a01 - a00 * k1 + R * k0 * k1
+        u10 = a10 * (1. - k0) + R * k1 * k0
+        u11 = a11 - a10 * k1 + R * k1 * k1
+
+        new_x = np.empty(x0.shape + (2,))
+        new_x[..., 0] = x0 + k0 * y
+        new_x[..., 1] = x1 + k1 * y
+        new_P = np.empty(x0.shape + (2, 2))
+        new_P[..., 0, 0] = np.where(observed, u00, p00)
+        new_P[..., 0, 1] = np.where(observed, u01, p01)
+        new_P[..., 1, 0] = np.where(observed, u10, p10)
+        new_P[..., 1, 1] = np.where(observed, u11, p11)
+
+        self.x[rows] = new_x
+        self.P[rows] = new_P
+        return new_x[..., 0].copy()
@@ -0,0 +1,166 @@
+"""Low-overhead timing histograms and counters with a Prometheus text export.
+
+Hot paths record stage durations with Histogram.observe (a bucket search
+and three additions under a lock). Values that already live elsewhere, such
+as queue depths or cache hit counts, are read only when /metrics is scraped,
+by collectors registered with register_collector. SamplingProfiler can be
+switched on at runtime to see where time goes inside a stage.
+"""
+import sys
+import threading
+from bisect import bisect_left
+from collections import Counter as StackCounter
+
+# Seconds, from 10 µs to 10 s
+DEFAULT_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3,
+                   1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_metrics = []
+_collectors = []
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labelnames, labelvalues, extra=""):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """Cumulative-bucket histogram, one series per tuple of label values"""
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}  # label values -> [per-bucket counts (+Inf last), sum]
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, *labelvalues):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labelvalues, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = format_labels(self.labelnames, labelvalues, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter, one series per tuple of label values"""
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._series = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._series[labelvalues] = self._series.get(labelvalues, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            series = list(self._series.items())
+        lines += [f"{self.name}{format_labels(self.labelnames, labels)} {value}" for labels, value in series]
+        return lines
+
+
+def register_collector(collect):
+    """Register a callable run on every scrape.
+
+    It returns (name, type, help, samples) tuples, where samples is a list
+    of (labels dict, value) pairs.
+    """
+    _collectors.append(collect)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _metrics:
+        lines += metric.render()
+    for collect in _collectors:
+        for name, kind, help, samples in collect():
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+            lines += [f"{name}{format_labels(list(labels), list(labels.values()))} {value}"
+                      for labels, value in samples]
+    return "\n".join(lines) + "\n"
+
+
+MIN_SAMPLE_INTERVAL = 0.001  # Shorter intervals would have the sampler hog the GIL
+
+
+class SamplingProfiler:
+    """Samples every thread's Python stack at a fixed interval.
+
+    Stacks are aggregated in the collapsed "frame;frame;frame count" format
+    read by flame graph tools. Only costs anything while running.
+    """
+
+    def __init__(self):
+        self.interval = 0.005
+        self.samples = StackCounter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=0.005):
+        """Start sampling every `interval` seconds (at least MIN_SAMPLE_INTERVAL)"""
+        if self.running:
+            return
+        self.interval = max(interval, MIN_SAMPLE_INTERVAL)
+        self.samples = StackCounter()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]})")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+
+    def collapsed(self, limit=None):
+        """The most frequent stacks, one "stack count" line each"""
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common(limit)) + "\n"
+
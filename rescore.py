@@ -0,0 +1,341 @@
+"""Offline re-scoring of archived sensor logs.
+
+Streams a CSV shaped like processed_data.csv in chunks through the same
+Kalman filtering and risk scoring as live ingestion, e.g. after changing
+the filter settings. Each chunk is filtered with one bank step per
+reading round (all subjects' r-th readings together). The risk score and
+the trend statistics behind the status run as array operations. Only the
+filter rows and the last few risks of each subject are carried between
+chunks, so memory stays flat however large the file is.
+
+Work is split across processes:
+  - by subject (each process keeps the subjects hashed to it), when the
+    file has a subject column, or
+  - by time (each process takes a contiguous block of rows), otherwise.
+    Each block starts `--warmup` rows early so its filters have converged
+    by its first row. The file is scanned for newlines once up front, and
+    each process seeks straight to its block's byte offset, so no process
+    parses (or holds) the rows before its block. Rows must therefore not
+    contain quoted line breaks.
+
+Subject shards are not free either: every process parses the whole file and
+drops the other subjects' rows, so the parsing work grows with --workers
+(memory stays flat). When parsing dominates, --shard-by time splits it
+instead, at the cost of the warm-up rows.
+
+Each process writes its results as part files in the output directory:
+Parquet when pyarrow is installed, NPZ per chunk otherwise. Rows are
+grouped by subject and ordered by time within a chunk.
+
+    python rescore.py archive.csv rescored/ --workers 4 --settings kf_settings.json
+"""
+import argparse
+import json
+import os
+import time
+import zlib
+from functools import partial
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+import risk_engine
+from kalman_bank import KalmanFilterBank
+from subjects import DEFAULT_SUBJECT
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+TIME_COLUMN = "Time of Reading"
+# Live vital -> archive column
+DATASET_COLUMNS = {
+    "V0": "Temperature (°C)",
+    "V1": "Relative Humidity (%)",
+    "V2": "Body Temperature (°C)",
+    "V3": "SpO2 (%)",
+    "V4": "Heart Rate (bpm)",
+}
+VITAL_KEYS = risk_engine.VITAL_KEYS
+TREND_LENGTH = 30  # As SubjectState.trend
+ROLLING_LENGTH = 5  # As SubjectState.rolling
+
+
+def window_stats(tail, values, size):
+    """Mean, sample count and windows of the last `size` samples after each of values is pushed.
+
+    tail holds the samples before values (at most size - 1). Returns the
+    per-value (mean, count, windows) and the new tail.
+    """
+    series = np.concatenate([np.full(size - 1 - len(tail), np.nan), tail, values])
+    windows = sliding_window_view(series, size)
+    counts = np.count_nonzero(~np.isnan(windows), axis=1)
+    mean = np.nansum(windows, axis=1) / counts
+    new_tail = series[-(size - 1):]
+    return mean, counts, windows, new_tail[~np.isnan(new_tail)]
+
+
+def forward_fill(values, carry):
+    """Fill NaNs with the last seen value of each column, starting from carry (like current_vitals)"""
+    values = np.vstack([carry, values])
+    index = np.where(~np.isnan(values), np.arange(len(values))[:, None], 0)
+    np.maximum.accumulate(index, axis=0, out=index)
+    return values[index, np.arange(values.shape[1])][1:]
+
+
+class SubjectTrack:
+    """What is carried between chunks for one subject"""
+
+    __slots__ = ("slot", "last", "trend_tail", "rolling_tail")
+
+    def __init__(self, slot, n_vitals):
+        self.slot = slot
+        self.last = np.zeros(n_vitals)  # Unseen vitals read as 0, as in live ingestion
+        self.trend_tail = np.empty(0)
+        self.rolling_tail = np.empty(0)
+
+
+class Rescorer:
+    """Filters and scores chunks of readings, keeping per-subject state between them"""
+
+    def __init__(self, kf_settings=None, forecast_temp=0.0):
+        kf_settings = kf_settings or risk_engine.kf_settings
+        self.bank = KalmanFilterBank(
+            Q=[setting["Q"] for setting in kf_settings], R=[setting["R"] for setting in kf_settings],
+            n_subjects=0, initial_uncertainty=1e6
+        )
+        self.forecast_temp = forecast_temp  # 0 disables the forecast deviation term
+        self.tracks = {}
+
+    def track(self, subject_id):
+        track = self.tracks.get(subject_id)
+        if track is None:
+            slot = len(self.tracks)
+            if slot >= self.bank.n_subjects:
+                self.bank.resize(max(1, 2 * self.bank.n_subjects))
+            track = self.tracks[subject_id] = SubjectTrack(slot, len(VITAL_KEYS))
+        return track
+
+    def score_chunk(self, subject_ids, timestamps, raw):
+        """Score a chunk of readings; returns output columns grouped by subject, in time order"""
+        codes, names = pd.factorize(subject_ids)
+        order = np.lexsort((np.arange(len(codes)), timestamps, codes))
+        codes, timestamps, raw = codes[order], timestamps[order], raw[order]
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        lengths = np.diff(np.r_[starts, len(codes)])
+        tracks = [self.track(names[code]) for code in codes[starts]]
+
+        values = np.empty_like(raw)
+        for track, start, length in zip(tracks, starts, lengths):
+            values[start:start + length] = forward_fill(raw[start:start + length], track.last)
+            track.last = values[start + length - 1]
+
+        # Round r advances every subject's r-th reading of the chunk in one step
+        filtered = np.empty_like(values)
+        slots = np.array([track.slot for track in tracks])
+        for r in range(lengths.max(initial=0)):
+            active = lengths > r
+            rows = starts[active] + r
+            filtered[rows] = np.round(self.bank.step(values[rows], slots[active]), 3)
+
+        risk = risk_engine.score_vitals(filtered, self.forecast_temp)
+        rounded = np.round(risk, 2)
+        status = np.empty(len(risk))
+        rolling_mean = np.empty(len(risk))
+        volatility = np.empty(len(risk))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            for track, start, length in zip(tracks, starts, lengths):
+                rows = slice(start, start + length)
+                mean, _, windows, track.trend_tail = window_stats(track.trend_tail, risk[rows], TREND_LENGTH)
+                spikes = np.count_nonzero(windows > (mean + 10)[:, None], axis=1)
+                status[rows] = np.select([mean > 80, (spikes > 5) | (mean > 60)],
+                                         [risk_engine.UNSTABLE, risk_engine.MONITOR], risk_engine.STABLE)
+                mean, counts, windows, track.rolling_tail = window_stats(track.rolling_tail, rounded[rows],
+                                                                         ROLLING_LENGTH)
+                squares = np.nansum((windows - mean[:, None]) ** 2, axis=1)
+                rolling_mean[rows] = mean
+                volatility[rows] = np.where(counts > 1, np.sqrt(squares / (counts - 1)), 0.0)
+
+        columns = {"subject_id": np.asarray(names)[codes].astype(str), "timestamp_us": timestamps}
+        columns.update({f"raw_{vital_key}": raw[:, i] for i, vital_key in enumerate(VITAL_KEYS)})
+        columns.update({vital_key: filtered[:, i] for i, vital_key in enumerate(VITAL_KEYS)})
+        columns.update({"risk": rounded, "status": status.astype(np.int8),
+                        "rolling_mean": rolling_mean, "volatility": volatility})
+        return columns
+
+
+class PartWriter:
+    """Appends result chunks to one Parquet file, or one NPZ file per chunk without pyarrow"""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.chunks = 0
+        self._writer = None
+
+    def write(self, columns):
+        if pq is not None:
+            table = pa.table(columns)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(f"{self.prefix}.parquet", table.schema)
+            self._writer.write_table(table)
+        else:
+            np.savez(f"{self.prefix}-{self.chunks:05d}.npz", **columns)
+        self.chunks += 1
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def read_chunks(path, chunk_size, subject_column, offset=None, rows=None):
+    """Yield (subject ids, timestamps in µs, (n, 5) raw vitals) chunks of the CSV.
+
+    With offset (the byte offset of a data row, see row_offsets), reading
+    starts there: the rows before it are neither parsed nor kept in memory.
+    """
+    if offset is None:
+        yield from map(partial(chunk_arrays, subject_column=subject_column),
+                       pd.read_csv(path, chunksize=chunk_size, nrows=rows))
+        return
+    columns = pd.read_csv(path, nrows=0).columns
+    with open(path, "rb") as f:
+        f.seek(offset)
+        reader = pd.read_csv(f, chunksize=chunk_size, header=None, names=columns, nrows=rows)
+        yield from map(partial(chunk_arrays, subject_column=subject_column), reader)
+
+
+def chunk_arrays(chunk, subject_column):
+    if subject_column in chunk.columns:
+        subject_ids = chunk[subject_column].astype(str).to_numpy()
+    else:
+        subject_ids = np.full(len(chunk), DEFAULT_SUBJECT, dtype=object)
+    timestamps = pd.to_datetime(chunk[TIME_COLUMN]).to_numpy("datetime64[us]").astype(np.int64)
+    raw = np.column_stack([
+        chunk[column].to_numpy(dtype=float) if column in chunk.columns else np.full(len(chunk), np.nan)
+        for column in DATASET_COLUMNS.values()
+    ])
+    return subject_ids, timestamps, raw
+
+
+def count_rows(path):
+    """Data rows of a CSV, counting a last line without a trailing newline"""
+    lines = 0
+    last = b"\n"
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            lines += chunk.count(b"\n")
+            last = chunk[-1:]
+    return lines + (last != b"\n") - 1
+
+
+def row_offsets(path, rows):
+    """Byte offset at which each of the given data rows starts, in one pass over the file"""
+    wanted = sorted(set(rows))
+    offsets = {}
+    lines = 0  # Newlines before the current chunk; data row r follows the (r + 1)-th
+    position = 0
+    i = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            count = chunk.count(b"\n")
+            at, seen = -1, lines
+            while i < len(wanted) and wanted[i] + 1 <= lines + count:
+                while seen < wanted[i] + 1:
+                    at = chunk.index(b"\n", at + 1)
+                    seen += 1
+                offsets[wanted[i]] = position + at + 1
+                i += 1
+            lines += count
+            position += len(chunk)
+    return offsets
+
+
+def rescore_shard(job):
+    """Process one shard; returns (shard, rows written, seconds)"""
+    shard, n_shards, args, kf_settings, time_range = job
+    start_time = time.perf_counter()
+    rescorer = Rescorer(kf_settings, args.forecast_temp)
+    writer = PartWriter(os.path.join(args.output, f"part-{shard:04d}"))
+    written = 0
+    if time_range is None:
+        chunks = read_chunks(args.input, args.chunk_size, args.subject_column)
+        warmup = 0
+    else:
+        # end is None for the last shard, which reads to the end of the file
+        first, end, warmup, offset = time_range
+        rows = None if end is None else end - first + warmup
+        chunks = read_chunks(args.input, args.chunk_size, args.subject_column, offset, rows)
+
+    for subject_ids, timestamps, raw in chunks:
+        if time_range is None:
+            # Keep the subjects hashed to this shard
+            codes, names = pd.factorize(subject_ids)
+            shards = np.array([zlib.crc32(name.encode()) % n_shards for name in names], dtype=int)
+            keep = shards[codes] == shard
+            subject_ids, timestamps, raw = subject_ids[keep], timestamps[keep], raw[keep]
+        elif warmup:
+            # Warm-up rows only advance the filters and trend windows
+            skip = min(warmup, len(timestamps))
+            rescorer.score_chunk(subject_ids[:skip], timestamps[:skip], raw[:skip])
+            subject_ids, timestamps, raw = subject_ids[skip:], timestamps[skip:], raw[skip:]
+            warmup -= skip
+        if len(timestamps):
+            writer.write(rescorer.score_chunk(subject_ids, timestamps, raw))
+            written += len(timestamps)
+    writer.close()
+    return shard, written, time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="CSV with a 'Time of Reading' column and the vital columns")
+    parser.add_argument("output", help="directory for the part files")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--shard-by", choices=["auto", "subject", "time"], default="auto")
+    parser.add_argument("--subject-column", default="subject_id")
+    parser.add_argument("--chunk-size", type=int, default=100000, help="rows read at a time")
+    parser.add_argument("--warmup", type=int, default=1000, help="rows replayed before each time shard")
+    parser.add_argument("--settings", help="JSON list of per-vital {'Q': [[..]], 'R': ..} Kalman settings")
+    parser.add_argument("--forecast-temp", type=float, default=0.0,
+                        help="forecast body temperature for the deviation term (0 disables it)")
+    args = parser.parse_args()
+
+    kf_settings = None
+    if args.settings:
+        with open(args.settings) as f:
+            kf_settings = json.load(f)
+    shard_by = args.shard_by
+    if shard_by == "auto":
+        header = pd.read_csv(args.input, nrows=0).columns
+        shard_by = "subject" if args.subject_column in header else "time"
+
+    os.makedirs(args.output, exist_ok=True)
+    n_shards = max(1, args.workers)
+    if shard_by == "subject":
+        jobs = [(shard, n_shards, args, kf_settings, None) for shard in range(n_shards)]
+    else:
+        total = count_rows(args.input)
+        bounds = np.linspace(0, total, n_shards + 1).astype(int).tolist()
+        shards = [shard for shard in range(n_shards) if bounds[shard + 1] > bounds[shard]]
+        warmups = {shard: min(args.warmup, bounds[shard]) for shard in shards}
+        offsets = row_offsets(args.input, [bounds[shard] - warmups[shard] for shard in shards])
+        jobs = [(shard, n_shards, args, kf_settings,
+                 (bounds[shard], bounds[shard + 1] if shard < n_shards - 1 else None, warmups[shard],
+                  offsets[bounds[shard] - warmups[shard]]))
+                for shard in shards]
+
+    start = time.perf_counter()
+    with Pool(len(jobs)) as pool:
+        results = pool.map(rescore_shard, jobs)
+    elapsed = time.perf_counter() - start
+    rows = sum(written for _, written, _ in results)
+    print(f"✅ Re-scored {rows} rows in {elapsed:.1f}s ({rows / elapsed:.0f} rows/s) "
+          f"over {len(jobs)} {shard_by} shards -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
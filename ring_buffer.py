@@ -0,0 +1,82 @@
+"""Fixed-capacity columnar ring buffer for time-stamped vital histories.
+
+Values are kept as one float64 row per column plus an int64 timestamp array
+(microseconds since the epoch, naive local time like datetime.now()). Every
+sample is written twice, at i and i + capacity, so the most recent n samples
+are always one contiguous slice and windows are returned as zero-copy views.
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_timestamp_us(dt):
+    """Naive datetime -> int64 microseconds since the epoch"""
+    return (dt - EPOCH) // timedelta(microseconds=1)
+
+
+def timestamps_iso(timestamps):
+    """int64 microsecond timestamps -> list of ISO 8601 strings"""
+    return np.datetime_as_string(timestamps.astype("datetime64[us]"), unit="us").tolist()
+
+
+class RingBuffer:
+    """Preallocated history of the last `capacity` samples of named columns"""
+
+    __slots__ = ("columns", "capacity", "timestamps", "values", "_index", "_start", "_size")
+
+    def __init__(self, columns, capacity=100):
+        self.columns = list(columns)
+        self.capacity = capacity
+        self.timestamps = np.zeros(2 * capacity, dtype=np.int64)
+        self.values = np.zeros((len(self.columns), 2 * capacity))
+        self._index = {name: i for i, name in enumerate(self.columns)}
+        self._start = 0  # Position of the oldest sample
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, timestamp_us, values):
+        """Append one sample; values are given in column order.
+
+        The slot is written before _size or _start publishes it, so a
+        concurrent window never covers an unwritten slot.
+        """
+        pos = (self._start + self._size) % self.capacity  # The oldest sample's slot when full
+        self.timestamps[pos] = self.timestamps[pos + self.capacity] = timestamp_us
+        self.values[:, pos] = self.values[:, pos + self.capacity] = values
+        if self._size < self.capacity:
+            self._size += 1
+        else:
+            self._start = (self._start + 1) % self.capacity
+
+    def _window(self, n):
+        start, size = self._start, self._size  # Read once; appends may run concurrently
+        n = size if n is None else min(n, size)
+        return slice(start + size - n, start + size)
+
+    def window(self, n=None):
+        """Views of the last n samples (all if None): (timestamps, values[columns, n])"""
+        rows = self._window(n)
+        return self.timestamps[rows], self.values[:, rows]
+
+    def column(self, name, n=None):
+        """View of the last n samples of one column"""
+        return self.values[self._index[name], self._window(n)]
+
+    def snapshot(self, n=None):
+        """Copies of the last n samples from a single window: (timestamps, {column: values}).
+
+        Use it to read several columns while appends may run, as separate
+        window/column calls can each see a different number of samples.
+        """
+        timestamps, values = self.window(n)
+        values = values.copy()
+        return timestamps.copy(), {name: values[i] for name, i in self._index.items()}
+
+    def clear(self):
+        self._start = 0
+        self._size = 0
@@ -0,0 +1,376 @@
+"""Ingestion and risk scoring core: Kalman filtering, risk score and histories.
+
+Only needs NumPy, so it can run in the slim ingestion-only server
+(ingestion_server.py) as well as inside the full forecasting server
+(Tft_Forecast.py), which plugs its forecasts in through forecast_source.
+"""
+import time
+from datetime import datetime
+
+import numpy as np
+
+import metrics
+from kalman_bank import KalmanFilterBank
+from subjects import SubjectRegistry
+from ring_buffer import timestamps_iso, to_timestamp_us
+
+# ✅ Instrumentation
+# Per call: one reading for calculate_heatstroke_risk, one micro-batch for ingest_batch
+STAGE_SECONDS = metrics.Histogram(
+    "heatstroke_ingest_stage_seconds", "Time spent in each ingestion stage per call", ("stage",)
+)
+BATCH_READINGS = metrics.Histogram(
+    "heatstroke_ingest_batch_readings", "Readings per ingest_batch call",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+)
+
+# ✅ Initialize Kalman Filters for each vital parameter
+# Custom Kalman filter settings for each parameter
+kf_settings = [
+    {"Q": [[1e-5, 0], [0, 1e-5]], "R": 1e-2},  # V0 - Atmospheric Temp (slow variations)
+    {"Q": [[5e-5, 0], [0, 5e-5]], "R": 2.5e-2},  # V1 - Humidity (medium variability)
+    {"Q": [[1e-5, 0], [0, 1e-5]], "R": 0.3},  # V2 - Body Temp (smooth, precise, ±2°C flexibility)
+    {"Q": [[5e-5, 0], [0, 5e-5]], "R": 0.2},  # V3 - SpO2 (±3 tolerance, reacts <95%)
+    {"Q": [[1e-6, 0], [0, 1e-6]], "R": 1.0}   # V4 - Heart Rate (rigid, prevents erratic jumps)
+]
+VITAL_KEYS = [f"V{i}" for i in range(len(kf_settings))]
+# Vitals a binary frame carries: V5 is kept with the raw vitals but not filtered or scored
+FRAME_KEYS = VITAL_KEYS + ["V5"]
+
+# Global Kalman filter bank: one constant-velocity filter per vital, with one
+# row per subject (grown by the subject registry as wearers connect)
+kf = KalmanFilterBank(
+    Q=[setting["Q"] for setting in kf_settings],  # Process noise
+    R=[setting["R"] for setting in kf_settings],  # Measurement noise
+    n_subjects=0,
+    initial_uncertainty=1e6  # Large initial uncertainty
+)
+
+# ✅ Real-time Data Storage (one SubjectState per wearer, idle ones evicted)
+subjects = SubjectRegistry(kf, max_subjects=10000, idle_ttl=3600)
+
+# Set up the Kalman filters with specialized settings for each parameter
+def setup_kalman_filters():
+    # Drop all subjects; each new one starts at zero with large uncertainty
+    subjects.clear()
+
+# Function to filter incoming vital readings through Kalman filters
+def filter_vitals(raw_vitals, state, timestamp=None):
+    values = [raw_vitals.get(vital_key, 0) for vital_key in VITAL_KEYS]
+    
+    # Store raw values (the filtered ones are stored with the risk assessment)
+    state.raw.append(to_timestamp_us(timestamp or datetime.now()), values)
+    
+    # Advance every vital's filter for this subject in one vectorized step
+    with subjects.lock:
+        positions = kf.step(values, subjects=[state.slot])[0]
+    
+    # Get position estimates as the filtered vitals dictionary
+    return {vital_key: round(float(positions[i]), 3) for i, vital_key in enumerate(VITAL_KEYS)}
+
+def fill_forward(rows, starts):
+    """Replace each NaN with the last value above it in its column, within the
+    segments of rows beginning at starts (NaN if there is none)"""
+    index = np.where(np.isnan(rows), 0, np.arange(len(rows))[:, None])
+    index[starts] = np.asarray(starts)[:, None]
+    np.maximum.accumulate(index, axis=0, out=index)
+    return rows[index, np.arange(rows.shape[1])]
+
+# Function to filter a batch of readings, possibly for many subjects
+def filter_vitals_batch(batch):
+    """Filter (state, reading, timestamp) triples given in time order.
+
+    A reading is a dict of vitals or, from binary ingestion, a V0-V5 float
+    array in which NaN marks a vital that was not sent.
+
+    Each reading becomes a row of the values it sets, and every subject's
+    rows are forward-filled from its current vitals in one vectorized pass
+    over the batch. This happens before any subject state is touched, so a
+    malformed reading raises first. Round r then steps the r-th reading of
+    every subject in the batch together, so the bank advances once per round
+    instead of once per reading. Returns the (n, 5) filtered values and the
+    (n, 6) merged raw V0-V5 values of each reading (V5 NaN until one is sent).
+    """
+    queues = {}
+    for row, (state, _, _) in enumerate(batch):
+        queues.setdefault(state.subject_id, []).append(row)
+    states = [batch[rows[0]][0] for rows in queues.values()]
+    
+    n_vitals = len(VITAL_KEYS)
+    updates = np.full((len(batch), len(FRAME_KEYS)), np.nan)
+    dicts, arrays = [], []
+    for row, (_, reading, _) in enumerate(batch):
+        (dicts if isinstance(reading, dict) else arrays).append(row)
+    if dicts:
+        updates[dicts] = [[batch[row][1].get(key, np.nan) for key in FRAME_KEYS] for row in dicts]
+    if arrays:
+        updates[arrays] = [batch[row][1] for row in arrays]
+    carry = np.array([[state.current_vitals.get(key, 0 if key != "V5" else np.nan) for key in FRAME_KEYS]
+                      for state in states], dtype=float)
+    
+    # Lay each subject's current vitals out followed by its readings, and fill forward
+    sequence, starts = [], []
+    for j, rows in enumerate(queues.values()):
+        starts.append(len(sequence))
+        sequence.append(len(batch) + j)
+        sequence += rows
+    sequence = np.array(sequence)
+    filled = fill_forward(np.concatenate([updates, carry])[sequence], starts)
+    is_reading = sequence < len(batch)
+    values = np.empty_like(updates)
+    values[sequence[is_reading]] = filled[is_reading]
+    if np.isinf(values).any() or np.isnan(values[:, :n_vitals]).any():
+        raise ValueError("Vitals must be finite")
+    timestamps = [to_timestamp_us(timestamp) for _, _, timestamp in batch]
+    
+    for row in dicts:
+        batch[row][0].current_vitals.update(batch[row][1])  # Keeps other keys sent along
+    if arrays:
+        # The vitals binary frames set are only in the filled rows
+        last = filled[np.array(starts[1:] + [len(sequence)]) - 1].tolist()
+        for state, latest in zip(states, last):
+            state.current_vitals.update((key, value) for key, value in zip(FRAME_KEYS, latest) if value == value)
+    for state, rows in zip(states, queues.values()):
+        for row in rows:
+            state.raw.append(timestamps[row], values[row, :n_vitals])
+    
+    filtered = np.empty((len(batch), n_vitals))
+    for r in range(max((len(rows) for rows in queues.values()), default=0)):
+        rows = [queue[r] for queue in queues.values() if len(queue) > r]
+        with subjects.lock:
+            positions = kf.step(values[rows, :n_vitals], subjects=[batch[row][0].slot for row in rows])
+        filtered[rows] = np.round(positions, 3)
+    
+    return filtered, values
+
+# ✅ Risk Calculation Based on Trends & Model
+# Status labels, indexed by the status code stored in the history
+STABLE, MONITOR, UNSTABLE = range(3)
+RISK_LABELS = ["Stable ✅", "Monitor Closely ⚠️", "UNSTABLE 🚨"]
+
+# Forecast lookup installed by the forecasting component: state -> the
+# (point, lower, upper) forecast body temperature for now, i.e. the point
+# forecast and its interval band, or None. Without a forecast
+# (ingestion-only profile) the deviation term is skipped.
+forecast_source = None
+NO_FORECAST = (0, 0, 0)  # A point forecast of 0 disables the deviation term
+
+# Callables run as listener(state, assessment, previous_assessment) after
+# each assessment is recorded, e.g. to push it to streaming clients
+assessment_listeners = []
+
+def forecast_band(state):
+    """(point, lower, upper) forecast body temperature for a subject, NO_FORECAST if there is none"""
+    band = forecast_source(state) if forecast_source is not None else None
+    return band if band is not None else NO_FORECAST
+
+def score_vitals(values, tft_pred_temp, lower=None, upper=None):
+    """Model-adjusted risk for an (n, 5) array of V0-V4 readings.
+
+    tft_pred_temp is the forecast body temperature, a scalar or one per row.
+    With the forecast's interval band (lower / upper, likewise), only the
+    part of the body temperature outside the band counts as deviation;
+    without it, the whole difference from the forecast does.
+    """
+    atm_temp = values[:, 0]  # Atmospheric Temperature (°C)
+    humidity = values[:, 1]  # Relative Humidity (%)
+    body_temp = values[:, 2]  # Body Temperature (°C)
+    spo2 = values[:, 3]  # SpO2 (Oxygen Saturation)
+    heart_rate = values[:, 4]  # Heart Rate (bpm)
+    
+    # Estimate Solar Radiation (W/m²) from Atmospheric Temperature
+    solar_radiation = np.maximum(0, (atm_temp - 15) * 50)  # Rough estimation
+    
+    # Compute risk score based on vitals
+    risk_score = (
+        (body_temp / 42) * 40 + (heart_rate / 200) * 25 + 
+        (humidity / 100) * 20 + (solar_radiation / 1000) * 10 - (spo2 / 100) * 15
+    )
+    live_risk = np.clip(risk_score, 0, 100)
+    
+    # Compare against TFT predictions
+    tft_pred_temp = np.asarray(tft_pred_temp, dtype=float)
+    if lower is None:
+        excess = np.abs(body_temp - tft_pred_temp)
+    else:
+        excess = np.maximum(np.maximum(np.subtract(lower, body_temp), np.subtract(body_temp, upper)), 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        deviation = np.where(tft_pred_temp != 0, excess / tft_pred_temp * 100, 0)
+    return np.minimum(live_risk + deviation, 100)
+
+def record_assessment(vitals, model_adjusted_risk, state, timestamp=None):
+    """Apply trend analysis to a scored reading and store it in the subject's history"""
+    timestamp = timestamp or datetime.now()
+    
+    # Analyze trends (running statistics, updated in O(1) per reading)
+    state.trend.push(model_adjusted_risk)
+    moving_avg = state.trend.mean
+    spikes = state.trend.count_above(moving_avg + 10)  # Count major spikes
+    
+    # Adjust final risk based on trends
+    if moving_avg > 80:
+        status = UNSTABLE
+    elif spikes > 5 or moving_avg > 60:
+        status = MONITOR
+    else:
+        status = STABLE
+    
+    # Store this assessment with timestamp and vitals
+    risk = round(model_adjusted_risk, 2)
+    assessment = {
+        "Risk (%)": risk,
+        "Status": RISK_LABELS[status],
+        "timestamp": timestamp.isoformat(),
+        "vitals": vitals.copy()
+    }
+    
+    # Maintain the rolling mean / volatility series shown in the graphs
+    state.rolling.push(risk)
+    
+    # Update the subject's state; the history row holds the filtered vitals,
+    # the risk, the status code and the rolling statistics
+    previous = state.last_risk_assessment
+    state.last_risk_assessment = assessment
+    row = [vitals.get(vital_key, 0) for vital_key in VITAL_KEYS]
+    row += [risk, status, state.rolling.mean, state.rolling.std]
+    state.history.append(to_timestamp_us(timestamp), row)
+    
+    # Invalidate graphs that read the histories
+    state.versions["risk"] += 1
+    state.versions["vitals"] += 1
+    state.readings += 1
+    
+    for listener in assessment_listeners:
+        # The assessment is already recorded: a failing listener must not
+        # fail the rest of the batch
+        try:
+            listener(state, assessment, previous)
+        except Exception as e:
+            print(f"❌ Assessment listener failed: {e}")
+    
+    return assessment
+
+def calculate_heatstroke_risk(vitals, state, timestamp=None):
+    start = time.perf_counter()
+    tft_pred_temp, lower, upper = forecast_band(state)
+    lookup_done = time.perf_counter()
+    values = np.array([[vitals.get(vital_key, 0) for vital_key in VITAL_KEYS]], dtype=float)
+    model_adjusted_risk = float(score_vitals(values, tft_pred_temp, lower, upper)[0])
+    score_done = time.perf_counter()
+    assessment = record_assessment(vitals, model_adjusted_risk, state, timestamp)
+    STAGE_SECONDS.observe(lookup_done - start, "forecast_lookup")
+    STAGE_SECONDS.observe(score_done - lookup_done, "score")
+    STAGE_SECONDS.observe(time.perf_counter() - score_done, "record")
+    return assessment
+
+# ✅ Ingestion
+def parse_timestamp(value):
+    """Reading timestamp (epoch seconds or ISO 8601) as a naive local datetime, or now.
+
+    Raises ValueError for other types and out-of-range values. ISO strings
+    with an offset (e.g. "Z") are converted to local time, as the histories
+    and the ingest ordering compare naive datetimes.
+    """
+    if value is None:
+        return datetime.now()
+    try:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return datetime.fromtimestamp(value)
+        if isinstance(value, str):
+            timestamp = datetime.fromisoformat(value)
+            if timestamp.tzinfo is not None:
+                timestamp = timestamp.astimezone().replace(tzinfo=None)
+            return timestamp
+    except (OverflowError, OSError, ValueError):
+        raise ValueError(f"Timestamp out of range or malformed: {value!r}")
+    raise ValueError(f"Timestamp must be epoch seconds or an ISO 8601 string, got {value!r}")
+
+class ReadingBlock:
+    """Readings decoded from binary frames, queued and ingested as one item.
+
+    subject_ids is a list, seconds an array of epoch seconds and vitals an
+    (n, 6) V0-V5 array in which NaN marks a vital that was not sent.
+    """
+
+    __slots__ = ("subject_ids", "seconds", "vitals")
+
+    def __init__(self, subject_ids, seconds, vitals):
+        self.subject_ids = subject_ids
+        self.seconds = seconds
+        self.vitals = vitals
+
+    def __len__(self):
+        return len(self.subject_ids)
+
+    def take(self, rows):
+        """A block of the given rows"""
+        return ReadingBlock([self.subject_ids[row] for row in rows], self.seconds[rows], self.vitals[rows])
+
+    def readings(self):
+        """(subject id, timestamp, V0-V5 row) triples"""
+        return [(subject_id, datetime.fromtimestamp(seconds), vitals)
+                for subject_id, seconds, vitals in zip(self.subject_ids, self.seconds.tolist(), self.vitals)]
+
+def expand_readings(items):
+    """(subject id, timestamp, reading) triples, with each ReadingBlock expanded into its rows"""
+    readings = []
+    for item in items:
+        if isinstance(item, ReadingBlock):
+            readings += item.readings()
+        else:
+            readings.append(item)
+    return readings
+
+def ingest_batch(readings):
+    """Filter and score (subject id, timestamp, reading) triples in vectorized passes.
+
+    ReadingBlocks can be given among the triples and count as their rows.
+    Readings are processed in timestamp order (stable, so readings with equal
+    timestamps keep their order). Returns one result per reading in the
+    order given.
+    """
+    start = time.perf_counter()
+    readings = expand_readings(readings)
+    order = sorted(range(len(readings)), key=lambda i: readings[i][1])
+    batch = [(subjects.get(readings[i][0]), readings[i][2], readings[i][1]) for i in order]
+    
+    # Look the forecasts up before filtering, which is the first step that
+    # changes subject state
+    lookup_start = time.perf_counter()
+    bands = np.array([forecast_band(state) for state, _, _ in batch], dtype=float).reshape(-1, 3)
+    filter_start = time.perf_counter()
+    filtered, _ = filter_vitals_batch(batch)
+    score_start = time.perf_counter()
+    risks = score_vitals(filtered, bands[:, 0], bands[:, 1], bands[:, 2])
+    record_start = time.perf_counter()
+    
+    results = [None] * len(readings)
+    for row, i in enumerate(order):
+        state = batch[row][0]
+        state.filtered_vitals = dict(zip(VITAL_KEYS, filtered[row].tolist()))
+        risk = record_assessment(state.filtered_vitals, float(risks[row]), state, readings[i][1])
+        results[i] = {
+            "subject_id": state.subject_id,
+            "risk": risk
+        }
+    
+    end = time.perf_counter()
+    for stage, begin, finish in (("subject_lookup", start, lookup_start), ("forecast_lookup", lookup_start, filter_start),
+                                 ("filter", filter_start, score_start), ("score", score_start, record_start),
+                                 ("record", record_start, end)):
+        STAGE_SECONDS.observe(finish - begin, stage)
+    BATCH_READINGS.observe(len(readings))
+    return results
+
+def assessment_records(timestamps, rows):
+    """History rows (V0-V4, risk, status code, ...) as the assessment dicts returned by /blynk_data"""
+    n_vitals = len(VITAL_KEYS)
+    return [
+        {
+            "Risk (%)": row[n_vitals],
+            "Status": RISK_LABELS[int(row[n_vitals + 1])],
+            "timestamp": timestamp,
+            "vitals": dict(zip(VITAL_KEYS, row[:n_vitals]))
+        }
+        for timestamp, row in zip(timestamps_iso(np.asarray(timestamps, dtype=np.int64)), rows)
+    ]
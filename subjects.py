@@ -0,0 +1,147 @@
+"""Per-subject session state for tracking many wearers in one process.
+
+Each subject (device / wearer) gets a compact SubjectState holding its
+histories, and a row ("slot") in a shared KalmanFilterBank so that all
+subjects' filters live in the same arrays. Idle subjects are evicted by
+LRU order and TTL so memory stays bounded as devices come and go.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from ring_buffer import RingBuffer
+from trend_stats import RollingStats
+
+DEFAULT_SUBJECT = "default"
+
+
+class SubjectState:
+    """Histories and latest readings for one subject"""
+
+    __slots__ = (
+        "subject_id", "slot", "last_seen",
+        "current_vitals", "filtered_vitals",
+        "raw", "history", "trend", "rolling",
+        "last_risk_assessment", "versions", "graphs", "readings"
+    )
+
+    def __init__(self, subject_id, slot, n_vitals=5, history_length=100, trend_length=30,
+                 rolling_length=5):
+        self.subject_id = subject_id
+        self.slot = slot  # Row of this subject in the Kalman filter bank
+        self.last_seen = time.monotonic()
+        self.current_vitals = {}
+        self.filtered_vitals = {}
+        vital_keys = [f"V{i}" for i in range(n_vitals)]
+        # Raw readings, and filtered vitals with the assessed risk, status code
+        # and rolling risk statistics, as columnar ring buffers
+        self.raw = RingBuffer(vital_keys, history_length)
+        self.history = RingBuffer(vital_keys + ["risk", "status", "rolling_mean", "volatility"],
+                                  history_length)
+        self.trend = RollingStats(trend_length)  # Last 30 risk scores, for the status
+        self.rolling = RollingStats(rolling_length)  # Rolling mean / volatility graphs
+        self.last_risk_assessment = {
+            "Risk (%)": 0,
+            "Status": "Waiting for data...",
+            "timestamp": datetime.now().isoformat(),
+            "vitals": {}
+        }
+        # Version counters of the histories, used to invalidate cached graphs
+        self.versions = {"risk": 0, "vitals": 0}
+        self.graphs = {}  # Cached graphs built from this subject's histories
+        self.readings = 0  # Assessments recorded since the subject was added
+
+
+class SubjectRegistry:
+    """LRU/TTL-bounded map of subject id -> SubjectState.
+
+    Subjects share the rows of one KalmanFilterBank. The bank grows in
+    doubling steps when every slot is taken, and evicted subjects' slots are
+    reused, with the filter reset, by the next new subject.
+    """
+
+    def __init__(self, bank, max_subjects=10000, idle_ttl=3600, **state_kwargs):
+        self.bank = bank
+        self.max_subjects = max_subjects
+        self.idle_ttl = idle_ttl  # Seconds without data before a subject is dropped
+        self.state_kwargs = state_kwargs
+        self.lock = threading.RLock()
+        self._states = OrderedDict()  # Least recently seen first
+        self._free_slots = []
+        self._next_slot = 0
+
+    def __len__(self):
+        return len(self._states)
+
+    def __contains__(self, subject_id):
+        return subject_id in self._states
+
+    def get(self, subject_id, create=True):
+        """Return the state for subject_id, creating it if needed.
+
+        Returns None if the subject is unknown and create is False.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._evict_expired(now)
+            state = self._states.get(subject_id)
+            if state is None:
+                if not create:
+                    return None
+                while len(self._states) >= self.max_subjects:
+                    self._evict_oldest()
+                state = SubjectState(subject_id, self._allocate_slot(), n_vitals=self.bank.n_vitals,
+                                     **self.state_kwargs)
+                self._states[subject_id] = state
+            else:
+                self._states.move_to_end(subject_id)
+            state.last_seen = now
+            return state
+
+    def peek(self, subject_id):
+        """Return the state for subject_id, or None, without taking the lock.
+
+        For readers: the subject's LRU position and TTL are left alone, and
+        fields such as last_risk_assessment are replaced whole by the ingest
+        workers, so a reader sees either the old or the new value.
+        """
+        return self._states.get(subject_id)
+
+    def subject_ids(self):
+        with self.lock:
+            return list(self._states)
+
+    def states(self):
+        """Snapshot of the tracked states, least recently seen first"""
+        with self.lock:
+            return list(self._states.values())
+
+    def clear(self):
+        with self.lock:
+            self._states.clear()
+            self._free_slots = []
+            self._next_slot = 0
+            self.bank.reset()
+
+    def _allocate_slot(self):
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            self.bank.reset([slot])
+            return slot
+        slot = self._next_slot
+        self._next_slot += 1
+        if slot >= self.bank.n_subjects:
+            self.bank.resize(max(1, 2 * self.bank.n_subjects))
+        return slot
+
+    def _evict_oldest(self):
+        _, state = self._states.popitem(last=False)
+        self._free_slots.append(state.slot)
+
+    def _evict_expired(self, now):
+        while self._states:
+            oldest = next(iter(self._states.values()))
+            if now - oldest.last_seen <= self.idle_ttl:
+                break
+            self._evict_oldest()
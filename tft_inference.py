@@ -0,0 +1,265 @@
+"""Lean CPU inference for the TFT model.
+
+Every TFTModel.predict call builds a Lightning Trainer and a dataloader,
+then runs the network in float64 eager mode. Here, the network is rebuilt
+from the state dict and hyperparameters in a saved model's checkpoint
+(tft_model.pth.ckpt) and called directly, in float32, under inference mode.
+The network can also be:
+  - quantized, by converting the nn.Linear and nn.LSTM weights to int8
+    (dynamic quantization),
+  - exported to TorchScript, which LeanForecaster loads with torch alone.
+    The graph is traced at a fixed batch size, and batches are padded to
+    that size at runtime,
+  - exported to ONNX, when the onnx package is installed.
+
+The network outputs the quantiles darts trained it for. LeanForecaster
+forecasts the median, and forecasts longer than one output chunk are rolled
+forward on that median. darts instead samples one quantile at random per
+step, so the compare command checks the quantiles themselves
+(predict_likelihood_parameters) over one output chunk, within a tolerance
+in scaled (0-1) units.
+
+Only models trained without covariates are supported, as tft_training.py
+trains them. tft_state_dict.pth, tft_hparams.pth and tft_model.h5 belong
+to an older pytorch-forecasting model and are not read here.
+
+    python tft_inference.py export tft_model.pth tft_model.ts.pt --quantize
+    python tft_inference.py compare tft_model.pth --lean tft_model.ts.pt --atol 1e-3
+"""
+import argparse
+import importlib.util
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+
+INT8_MODULES = {torch.nn.Linear, torch.nn.LSTM}
+
+
+def load_network(checkpoint_path):
+    """darts' TFT network built from a checkpoint's hyperparameters and state dict"""
+    from darts.models.forecasting.tft_model import _TFTModule
+
+    checkpoint = torch.load(checkpoint_path, map_location="cpu", weights_only=False)
+    network = _TFTModule(**checkpoint["hyper_parameters"])
+    network.load_state_dict(checkpoint["state_dict"])
+    return network
+
+
+class LeanTFT(torch.nn.Module):
+    """The bare network.
+
+    Maps a scaled (batch, input_chunk_length, components) window to
+    (batch, output_chunk_length, components, quantiles).
+    """
+
+    def __init__(self, network):
+        super().__init__()
+        self.network = network
+
+    def forward(self, window):
+        return self.network((window, None, None))
+
+
+def lean_network(checkpoint_path, quantize=False):
+    """A float32 LeanTFT in eval mode, with int8 Linear / LSTM weights if quantize"""
+    network = LeanTFT(load_network(checkpoint_path)).float().eval()
+    if quantize:
+        network = torch.ao.quantization.quantize_dynamic(network, INT8_MODULES, dtype=torch.qint8)
+    return network
+
+
+class LeanForecaster:
+    """Forecasts with a lean network; stands in for TFTModel.predict in the server.
+
+    batch_size is the fixed batch size of a traced network, or None for a
+    network that takes any batch size.
+    """
+
+    def __init__(self, network, input_chunk_length, output_chunk_length, quantiles, n_components,
+                 batch_size=None):
+        self.network = network
+        self.input_chunk_length = input_chunk_length
+        self.output_chunk_length = output_chunk_length
+        self.quantiles = list(quantiles)
+        self.n_components = n_components
+        self.batch_size = batch_size
+        self.median_index = self.quantiles.index(0.5)
+
+    @classmethod
+    def from_checkpoint(cls, checkpoint_path, quantize=False):
+        network = lean_network(checkpoint_path, quantize)
+        tft = network.network
+        return cls(network, tft.input_chunk_length, tft.output_chunk_length, tft.likelihood.quantiles,
+                   tft.n_targets)
+
+    @classmethod
+    def load(cls, path):
+        """Load a TorchScript export (needs torch only)"""
+        extra_files = {"meta.json": ""}
+        network = torch.jit.load(path, map_location="cpu", _extra_files=extra_files)
+        return cls(network, **json.loads(extra_files["meta.json"]))
+
+    @property
+    def meta(self):
+        return {
+            "input_chunk_length": self.input_chunk_length, "output_chunk_length": self.output_chunk_length,
+            "quantiles": self.quantiles, "n_components": self.n_components, "batch_size": self.batch_size,
+        }
+
+    def forward_quantiles(self, windows, batch_size=None):
+        """One output chunk of quantiles, (n, output_chunk_length, components, quantiles), for scaled windows"""
+        windows = torch.as_tensor(np.asarray(windows, dtype=np.float32))
+        size = self.batch_size or batch_size or len(windows)
+        outputs = []
+        with torch.inference_mode():
+            for start in range(0, len(windows), size):
+                batch = windows[start:start + size]
+                if self.batch_size is not None and len(batch) < size:
+                    # Pad with copies of the last window up to the traced batch size
+                    batch = torch.cat([batch, batch[-1:].expand(size - len(batch), -1, -1)])
+                outputs.append(self.network(batch)[:len(windows) - start])
+        return torch.cat(outputs).numpy()
+
+    def predict_quantiles(self, windows, n, batch_size=None):
+        """n steps of quantiles, rolling forward on the median after each output chunk"""
+        windows = np.asarray(windows, dtype=np.float32)[:, -self.input_chunk_length:]
+        chunks = []
+        steps = 0
+        while steps < n:
+            chunk = self.forward_quantiles(windows, batch_size)
+            chunks.append(chunk)
+            steps += chunk.shape[1]
+            windows = np.concatenate([windows, chunk[..., self.median_index]], axis=1)[:, -self.input_chunk_length:]
+        return np.concatenate(chunks, axis=1)[:, :n]
+
+    def predict(self, n, series, batch_size=None, **kwargs):
+        """Median forecast of n steps as TimeSeries, for one scaled series or a list"""
+        from darts import TimeSeries
+
+        single = isinstance(series, TimeSeries)
+        series = [series] if single else list(series)
+        windows = np.stack([s.values(copy=False)[-self.input_chunk_length:] for s in series])
+        median = self.predict_quantiles(windows, n, batch_size)[..., self.median_index]
+        preds = [
+            TimeSeries.from_times_and_values(
+                pd.date_range(s.end_time() + s.freq, periods=n, freq=s.freq, name=s.time_index.name),
+                values.astype(s.dtype), columns=s.components
+            )
+            for s, values in zip(series, median)
+        ]
+        return preds[0] if single else preds
+
+
+def export_torchscript(forecaster, path, batch_size=1):
+    """Trace the forecaster's network at batch_size and save it with its metadata"""
+    example = torch.zeros(batch_size, forecaster.input_chunk_length, forecaster.n_components)
+    tft = forecaster.network.network
+    tft._jit_is_scripting = True  # Lightning's `trainer` property raises without a Trainer otherwise
+    try:
+        with torch.inference_mode():
+            traced = torch.jit.trace(forecaster.network, example, check_trace=False)
+    finally:
+        tft._jit_is_scripting = False
+    meta = {**forecaster.meta, "batch_size": batch_size}
+    torch.jit.save(traced, path, _extra_files={"meta.json": json.dumps(meta)})
+
+
+def export_onnx(forecaster, path, batch_size=1):
+    """Export the (float) network to ONNX at a fixed batch size"""
+    example = torch.zeros(batch_size, forecaster.input_chunk_length, forecaster.n_components)
+    torch.onnx.export(forecaster.network, (example,), path, dynamo=False,
+                      input_names=["window"], output_names=["quantiles"])
+
+
+def export(args):
+    checkpoint_path = args.model + ".ckpt"
+    forecaster = LeanForecaster.from_checkpoint(checkpoint_path, quantize=args.quantize)
+    export_torchscript(forecaster, args.output, args.batch_size)
+    print(f"✅ TorchScript{' (int8)' if args.quantize else ''} -> {args.output}")
+    if args.onnx:
+        if importlib.util.find_spec("onnx") is None:
+            print("❌ ONNX export needs the onnx package")
+            return 1
+        export_onnx(LeanForecaster.from_checkpoint(checkpoint_path), args.onnx, args.batch_size)
+        print(f"✅ ONNX -> {args.onnx}")
+    return 0
+
+
+def median_ms(fn, repeats):
+    fn()  # Warm-up
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return float(np.median(latencies) * 1e3)
+
+
+def compare(args):
+    """Check lean outputs against darts and time single-series forecasts"""
+    from darts.models import TFTModel
+
+    from tft_training import load_series
+
+    model = TFTModel.load(args.model)
+    train, val, _ = load_series(args.data)
+    series = train.append(val)
+    input_length, chunk = model.input_chunk_length, model.output_chunk_length
+    ends = np.linspace(input_length, len(series), args.windows).astype(int)
+    windows = [series[end - input_length:end] for end in ends]
+
+    preds = model.predict(n=chunk, series=windows, predict_likelihood_parameters=True,
+                          batch_size=len(windows), verbose=False)
+    candidates = {
+        "eager": (LeanForecaster.from_checkpoint(args.model + ".ckpt"), args.atol),
+        "eager int8": (LeanForecaster.from_checkpoint(args.model + ".ckpt", quantize=True), args.int8_atol),
+    }
+    if args.lean:
+        candidates[args.lean] = (LeanForecaster.load(args.lean), args.atol)
+    n_quantiles = len(next(iter(candidates.values()))[0].quantiles)
+    expected = np.stack([pred.values() for pred in preds]).reshape(len(windows), chunk, -1, n_quantiles)
+    inputs = np.stack([window.values() for window in windows])
+
+    failed = False
+    darts_ms = median_ms(lambda: model.predict(n=args.horizon, series=windows[0], verbose=False), args.repeats)
+    print(f"{'model':<24} {'max |err|':>10} {'median ms':>10}")
+    print(f"{'darts':<24} {'':>10} {darts_ms:>10.2f}")
+    for name, (forecaster, atol) in candidates.items():
+        error = float(np.abs(forecaster.forward_quantiles(inputs) - expected).max())
+        lean_ms = median_ms(lambda: forecaster.predict_quantiles(inputs[:1], args.horizon), args.repeats)
+        ok = error <= atol
+        failed |= not ok
+        print(f"{name:<24} {error:>10.2e} {lean_ms:>10.2f}  {'✅' if ok else '❌'} (atol {atol:g}, "
+              f"{darts_ms / lean_ms:.1f}x)")
+    return int(failed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    parser_export = commands.add_parser("export", help="export a saved darts model for lean inference")
+    parser_export.add_argument("model", help="saved TFTModel, e.g. tft_model.pth (its .ckpt is read)")
+    parser_export.add_argument("output", help="TorchScript file, e.g. tft_model.ts.pt")
+    parser_export.add_argument("--quantize", action="store_true", help="int8 Linear / LSTM weights")
+    parser_export.add_argument("--batch-size", type=int, default=1, help="batch size the graph is traced at")
+    parser_export.add_argument("--onnx", help="also export the float network to this ONNX file")
+
+    parser_compare = commands.add_parser("compare", help="compare lean outputs and latency against darts")
+    parser_compare.add_argument("model", help="saved TFTModel, e.g. tft_model.pth")
+    parser_compare.add_argument("--lean", help="TorchScript export to check as well")
+    parser_compare.add_argument("--data", default="processed_data.csv")
+    parser_compare.add_argument("--windows", type=int, default=32, help="input windows compared")
+    parser_compare.add_argument("--atol", type=float, default=1e-3, help="max abs error, scaled units")
+    parser_compare.add_argument("--int8-atol", type=float, default=5e-2, help="max abs error of int8 models")
+    parser_compare.add_argument("--horizon", type=int, default=24, help="steps per timed forecast")
+    parser_compare.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+    return export(args) if args.command == "export" else compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
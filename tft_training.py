@@ -0,0 +1,236 @@
+"""TFT training and CPU hyperparameter sweeps.
+
+train_model trains one TFTModel on the cleaned dataset (read through the
+NPZ snapshot, so the CSV is only cleaned once) with early stopping on the
+validation loss. Every epoch is checkpointed, and evaluation uses the best
+checkpoint.
+
+The sweep CLI trains a grid of candidates in a process pool on the CPU.
+For each candidate it records the training wall-clock time, epochs run,
+validation error and single-series inference latency in results.jsonl, so
+a model can be chosen for accuracy under a CPU latency budget. Latency is
+measured after training, one saved model at a time with the pool idle, so
+it is not skewed by the other workers. A candidate that fails is reported
+and left out of the results; finished candidates are skipped when a sweep
+is re-run.
+
+    python tft_training.py --grid '{"hidden_size": [16, 32, 64], "input_chunk_length": [12, 24]}' \\
+        --workers 3 --latency-budget 50 --save-best tft_model.pth
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+import numpy as np
+
+from forecasting import load_dataset_snapshot, make_scaler, quantile_forecasts
+
+# The model Tft_Forecast.py trains when no saved model exists
+DEFAULT_CONFIG = {
+    "input_chunk_length": 24, "output_chunk_length": 12, "hidden_size": 64, "lstm_layers": 1,
+    "num_attention_heads": 4, "dropout": 0.1, "batch_size": 32, "n_epochs": 50, "lr": 1e-3,
+}
+
+
+def candidate_name(config):
+    """Stable name of a config (defaults filled in), used for its checkpoints and results"""
+    digest = hashlib.sha1(json.dumps({**DEFAULT_CONFIG, **config}, sort_keys=True).encode()).hexdigest()[:10]
+    return f"tft-{digest}"
+
+
+def load_series(csv_path="processed_data.csv", val_fraction=0.2):
+    """Scaled (train, val) series and the fitted scaler, from the dataset snapshot"""
+    from darts import TimeSeries
+
+    df, bounds = load_dataset_snapshot(csv_path)
+    scaler = make_scaler(df.columns, bounds)
+    series = scaler.transform(TimeSeries.from_dataframe(df, value_cols=df.columns))
+    train, val = series.split_before(1 - val_fraction)
+    return train, val, scaler
+
+
+def train_model(config, train, val, work_dir=None, patience=5, verbose=False):
+    """Fit a TFTModel with early stopping on val loss.
+
+    Returns the model (the best checkpoint's when work_dir is given) and the
+    number of epochs run.
+    """
+    from darts.models import TFTModel
+    from pytorch_lightning.callbacks import EarlyStopping
+
+    config = {**DEFAULT_CONFIG, **config}
+    checkpoints = work_dir is not None
+    model = TFTModel(
+        input_chunk_length=config["input_chunk_length"], output_chunk_length=config["output_chunk_length"],
+        hidden_size=config["hidden_size"], lstm_layers=config["lstm_layers"],
+        num_attention_heads=config["num_attention_heads"], dropout=config["dropout"],
+        batch_size=config["batch_size"], n_epochs=config["n_epochs"], add_relative_index=True,
+        optimizer_kwargs={"lr": config["lr"]}, random_state=config.get("random_state", 42),
+        model_name=candidate_name(config), work_dir=work_dir or os.getcwd(),
+        save_checkpoints=checkpoints, force_reset=checkpoints,
+        pl_trainer_kwargs={
+            "accelerator": "cpu",
+            "enable_progress_bar": verbose,
+            "callbacks": [EarlyStopping(monitor="val_loss", patience=patience, min_delta=1e-4)],
+        },
+    )
+    model.fit(train, val_series=val, verbose=verbose)
+    epochs_run = model.epochs_trained
+    if checkpoints:
+        model = TFTModel.load_from_checkpoint(candidate_name(config), work_dir=work_dir, best=True)
+    return model, epochs_run
+
+
+def evaluate(model, train, val, scaler, horizon=24):
+    """Validation error of a horizon-step median forecast.
+
+    The median is forecast as the server does (forecasting.quantile_forecasts),
+    not with the point predict, which samples one quantile at random per step.
+    """
+    from darts import TimeSeries
+    from darts.metrics import mae, rmse
+
+    quantiles, levels = quantile_forecasts(model, [train], horizon)
+    actual = val[:horizon]
+    median = quantiles[0, :len(actual), :, levels.index(0.5)].astype(train.dtype)
+    pred = TimeSeries.from_times_and_values(actual.time_index, median, columns=train.components)
+    actual, pred = scaler.inverse_transform(actual), scaler.inverse_transform(pred)
+    return {
+        "val_rmse": float(rmse(actual, pred)),
+        "val_mae": float(mae(actual, pred)),
+    }
+
+
+def inference_ms(model, series, horizon=24, repeats=5):
+    """Median CPU latency of a horizon-step quantile forecast of one series, in ms"""
+    quantile_forecasts(model, [series], horizon)  # Warm-up
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        quantile_forecasts(model, [series], horizon)
+        latencies.append(time.perf_counter() - start)
+    return float(np.median(latencies) * 1e3)
+
+
+def run_candidate(job):
+    """Train and score one sweep candidate (runs in a pool process); latency is measured later"""
+    config, args = job
+    import torch
+
+    torch.set_num_threads(args.threads)
+    train, val, scaler = load_series(args.data)
+    start = time.perf_counter()
+    model, epochs_run = train_model(config, train, val, work_dir=args.output, patience=args.patience)
+    train_seconds = time.perf_counter() - start
+    record = {
+        "name": candidate_name(config),
+        "config": {**DEFAULT_CONFIG, **config},
+        "epochs_run": int(epochs_run),
+        "train_seconds": train_seconds,
+        "threads": args.threads,
+        **evaluate(model, train, val, scaler, args.horizon),
+    }
+    model.save(os.path.join(args.output, f"{record['name']}.pth"))
+    return record
+
+
+def measure_latencies(records, args):
+    """Fill in inference_ms for the records without it, loading each saved model in turn"""
+    import torch
+    from darts.models import TFTModel
+
+    torch.set_num_threads(args.threads)  # As in training, so records stay comparable
+    train, _, _ = load_series(args.data)
+    for record in records:
+        if "inference_ms" in record:
+            continue
+        model = TFTModel.load(os.path.join(args.output, f"{record['name']}.pth"), map_location="cpu")
+        record["inference_ms"] = inference_ms(model, train, args.horizon)
+        print(f"⏱️ {record['name']}: {record['inference_ms']:.1f} ms")
+
+
+def expand_grid(grid):
+    """Every combination of the grid's value lists, as config dicts"""
+    keys = sorted(grid)
+    values = [grid[key] if isinstance(grid[key], list) else [grid[key]] for key in keys]
+    return [dict(zip(keys, combination)) for combination in itertools.product(*values)]
+
+
+def choose(records, latency_budget=None):
+    """Lowest-error record within the latency budget (ms), or None"""
+    eligible = [record for record in records
+                if latency_budget is None or record["inference_ms"] <= latency_budget]
+    return min(eligible, key=lambda record: record["val_rmse"], default=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data", default="processed_data.csv")
+    parser.add_argument("--grid", default="{}", help="JSON object of config key -> list of values")
+    parser.add_argument("--output", default="sweeps/default", help="checkpoints, models and results.jsonl")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=None, help="torch threads per worker")
+    parser.add_argument("--patience", type=int, default=5, help="epochs without val improvement before stopping")
+    parser.add_argument("--horizon", type=int, default=24)
+    parser.add_argument("--latency-budget", type=float, default=None, help="max inference ms when choosing")
+    parser.add_argument("--save-best", help="copy the chosen model here, e.g. tft_model.pth")
+    args = parser.parse_args()
+    args.threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+
+    os.makedirs(args.output, exist_ok=True)
+    load_series(args.data)  # Build the dataset snapshot once, before the workers read it
+    results_path = os.path.join(args.output, "results.jsonl")
+    records = []
+    if os.path.exists(results_path):
+        with open(results_path) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    done = {record["name"] for record in records}
+    pending = [config for config in expand_grid(json.loads(args.grid)) if candidate_name(config) not in done]
+    print(f"🔎 {len(pending)} candidates to train ({len(done)} already done)")
+
+    # Spawn, so workers do not inherit torch's threads from the parent
+    failed = 0
+    if pending:
+        with ProcessPoolExecutor(args.workers, mp_context=get_context("spawn")) as pool:
+            futures = {pool.submit(run_candidate, (config, args)): config for config in pending}
+            for future in as_completed(futures):
+                try:
+                    record = future.result()
+                except Exception as e:  # e.g. hidden_size not divisible by num_attention_heads
+                    failed += 1
+                    print(f"❌ {candidate_name(futures[future])} {futures[future]}: {e!r}")
+                    continue
+                records.append(record)
+                with open(results_path, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+                print(f"✅ {record['name']}: rmse={record['val_rmse']:.4f} "
+                      f"{record['train_seconds']:.0f}s / {record['epochs_run']} epochs")
+        if failed:
+            print(f"⚠️ {failed} candidates failed; they are retried on the next run")
+
+    # Serially, with the pool shut down; also covers runs interrupted before this pass
+    if any("inference_ms" not in record for record in records):
+        measure_latencies(records, args)
+        with open(results_path + ".tmp", "w") as f:
+            f.writelines(json.dumps(record) + "\n" for record in records)
+        os.replace(results_path + ".tmp", results_path)
+
+    best = choose(records, args.latency_budget)
+    if best is None:
+        print("❌ No candidate within the latency budget")
+        return
+    print(f"🏆 {best['name']}: rmse={best['val_rmse']:.4f} at {best['inference_ms']:.1f} ms, {best['config']}")
+    if args.save_best:
+        # A saved darts model is the .pth file plus its .pth.ckpt weights
+        for suffix in ("", ".ckpt"):
+            shutil.copyfile(os.path.join(args.output, f"{best['name']}.pth{suffix}"), args.save_best + suffix)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Streaming statistics over a sliding window of risk scores.
+
+Replaces recomputing np.mean / pandas rolling mean and std over the whole
+window for every reading: the mean and variance are maintained with
+Welford's algorithm (updated for the sample entering and the one leaving
+the window), so each push is O(1). A sorted copy of the window answers
+"how many samples are above x" with a binary search.
+"""
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+
+
+class RollingStats:
+    """Mean, sample standard deviation and threshold counts of the last `size` samples"""
+
+    __slots__ = ("size", "_window", "_sorted", "mean", "_m2")
+
+    def __init__(self, size):
+        self.size = size
+        self._window = deque()
+        self._sorted = []
+        self.mean = 0.0
+        self._m2 = 0.0  # Sum of squared deviations from the mean
+
+    def __len__(self):
+        return len(self._window)
+
+    def push(self, value):
+        """Add a sample, dropping the oldest one once the window is full"""
+        if len(self._window) == self.size:
+            self._remove(self._window.popleft())
+        self._window.append(value)
+        insort(self._sorted, value)
+        n = len(self._window)
+        delta = value - self.mean
+        self.mean += delta / n
+        self._m2 += delta * (value - self.mean)
+
+    def _remove(self, value):
+        del self._sorted[bisect_left(self._sorted, value)]
+        n = len(self._window)
+        if n == 0:
+            self.mean = 0.0
+            self._m2 = 0.0
+            return
+        delta = value - self.mean
+        self.mean -= delta / n
+        self._m2 = max(self._m2 - delta * (value - self.mean), 0.0)
+
+    @property
+    def std(self):
+        """Sample standard deviation (ddof=1, as pandas rolling().std()), 0 below two samples"""
+        n = len(self._window)
+        return (self._m2 / (n - 1)) ** 0.5 if n > 1 else 0.0
+
+    def count_above(self, threshold):
+        """Number of samples strictly greater than threshold"""
+        return len(self._sorted) - bisect_right(self._sorted, threshold)